@@ -9,13 +9,23 @@
     'website': "http://www.yourcompany.com",
     'category': 'Uncategorized',
     'version': '0.1',
-    'depends': ['base','sale','account','product', 'account_accountant', 'stock'],
+    'depends': ['base','mail','sale','account','product', 'account_accountant', 'stock'],
     'data': [
         # 'security/ir.model.access.csv',
         'views/view.xml',
         'views/sales.xml',
+        'views/schedule.xml',
+        'views/billing.xml',
+        'views/perf_stat.xml',
+        'views/reprice.xml',
+        'views/quotation_print.xml',
+        'views/contract_import.xml',
         'views/revenue.xml',
         'views/tax.xml',
         'views/product.xml',
+        'wizard/installment_quotation_print_views.xml',
+        'wizard/installment_payment_allocation_views.xml',
+        'report/installment_portfolio_report_views.xml',
+        'data/installment_cron.xml',
     ],
 }
\ No newline at end of file
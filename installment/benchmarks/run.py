@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Performance benchmarks of the installment module.
+
+Populates a database where the module is installed with generated data, times the hot paths of
+the module and counts their SQL queries, then rolls everything back. Usage::
+
+    python installment/benchmarks/run.py -c odoo.conf -d benchdb --orders 2000 --output results.json
+    python installment/benchmarks/run.py -c odoo.conf -d benchdb --update-baseline
+
+Results are compared with ``baseline.json`` (next to this script), which must have been recorded
+with the same volumes. The run exits with status 1 when:
+
+- there is no baseline, or it was recorded with other volumes;
+- a scenario is missing from the baseline, or a scenario of the baseline was not run;
+- a scenario runs more queries than its baseline;
+- a baseline has timings (recorded with ``--with-timings``) and the scenario is slower than
+  them by more than ``--time-tolerance``: total time for the batch scenarios, p99 latency
+  for the per-call ones.
+
+With fixed volumes and seed, query counts do not depend on the machine, so the committed
+baseline only holds query counts. It is recorded with the default volumes with
+``--update-baseline``, and recorded again in the same commit whenever a change moves the counts
+on purpose. Timings depend on the machine and are only added to local baselines.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import odoo
+from odoo import api, SUPERUSER_ID
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-c', '--config', help="Odoo configuration file")
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--terms', type=int, default=5)
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--partners', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=1, help="order lines per order")
+    parser.add_argument('--invoiced', type=float, default=0.5, help="share of the orders to invoice")
+    parser.add_argument('--quotes', type=int, default=1000, help="quote simulation calls")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--time-tolerance', type=float, default=0.25)
+    parser.add_argument('--output', help="write the results to this JSON file instead of stdout")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--with-timings', action='store_true', help="record the timings in the baseline too")
+    return parser.parse_args(argv)
+
+
+class Benchmark(object):
+
+    def __init__(self, env):
+        self.env = env
+        self.results = {}
+
+    def measure(self, name, func, records=1):
+        cr = self.env.cr
+        self.env.invalidate_all()
+        queries = cr.sql_log_count
+        start = time.time()
+        func()
+        duration = time.time() - start
+        self.results[name] = {
+            'queries': cr.sql_log_count - queries,
+            'seconds': round(duration, 4),
+            'records': records,
+        }
+
+    def latency(self, name, func, calls):
+        cr = self.env.cr
+        self.env.invalidate_all()
+        queries = cr.sql_log_count
+        durations = []
+        for index in range(calls):
+            start = time.time()
+            func(index)
+            durations.append(time.time() - start)
+        durations.sort()
+        self.results[name] = {
+            'queries': cr.sql_log_count - queries,
+            'calls': calls,
+            'p50_ms': round(durations[len(durations) // 2] * 1000, 3),
+            'p99_ms': round(durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000, 3),
+        }
+
+
+def populate(env, args):
+    rnd = random.Random(args.seed)
+    categories = env['product.category']
+    for index in range(args.categories):
+        categories |= categories.create({'name': 'Bench category %d' % index})
+    terms = env['deferred.revenue.custom']
+    for index in range(args.terms):
+        terms |= terms.create({
+            'name': 'Bench term %d' % index,
+            'number_of_months': rnd.choice([12, 24, 36, 48, 60]),
+            'spot_adv_discount': rnd.choice([0, 5, 10]),
+            'deferred_adv_discount': rnd.choice([0, 5]),
+            'deferred_adv_count': rnd.choice([1, 3, 6]),
+            'covered_category_ids': [(0, 0, {
+                'product_category_id': categ.id,
+                'interest_type': rnd.choice(['simple', 'compound']),
+                'interest_rate': rnd.choice([6, 10, 12, 18]),
+                'advance_payment_type': rnd.choice(['perc', 'fix']),
+                'advance_payment': rnd.choice([10, 20, 30]),
+            }) for categ in categories],
+        })
+    tax = env['account.tax'].create({
+        'name': 'Bench VAT 12%', 'amount_type': 'vat', 'amount': 12.0, 'type_tax_use': 'sale',
+    })
+    products = env['product.product']
+    for categ in categories:
+        products |= products.create({
+            'name': 'Bench product %s' % categ.name, 'categ_id': categ.id, 'list_price': 100000.0,
+            'default_code': 'BENCH-%d' % categ.id, 'taxes_id': [(6, 0, tax.ids)], 'invoice_policy': 'order',
+        })
+    partners = env['res.partner']
+    for index in range(args.partners):
+        partners |= partners.create({'name': 'Bench customer %d' % index, 'customer': True})
+
+    Order = env['installment.sale'].with_context(installment_tracking='off', mail_create_nolog=True)
+    orders = Order.browse()
+    for index in range(args.orders):
+        product = rnd.choice(products)
+        partner = rnd.choice(partners)
+        orders |= Order.create({
+            'partner_id': partner.id,
+            'partner_invoice_id': partner.id,
+            'partner_shipping_id': partner.id,
+            'pricelist_id': partner.property_product_pricelist.id,
+            'product_category_id': product.categ_id.id,
+            'deferred_revenue_id': rnd.choice(terms).id,
+            'is_spot_advance': index % 2 == 0,
+            'is_deferred_advance': index % 2 == 1,
+            'order_line': [(0, 0, {
+                'product_id': product.id,
+                'name': product.name,
+                'product_uom': product.uom_id.id,
+                'product_uom_qty': 1.0,
+                'price_unit': rnd.randint(50, 500) * 1000.0,
+                'tax_id': [(6, 0, tax.ids)],
+            }) for line in range(args.lines)],
+        })
+    return {'terms': terms, 'categories': categories, 'products': products, 'tax': tax, 'orders': orders}
+
+
+def run(env, args):
+    data = populate(env, args)
+    bench = Benchmark(env)
+    orders = data['orders']
+    to_invoice = orders[:int(len(orders) * args.invoiced)]
+    count = len(orders)
+
+    def revenue_domain():
+        for order in orders:
+            env['installment.sale'].new({'product_category_id': order.product_category_id.id,
+                                         'purchase_type': 'install'})._revenue_domain()
+
+    order_lines = orders.mapped('order_line')
+
+    def vat_compute():
+        for line in order_lines:
+            data['tax'].vat_compute(line.price_unit, quantity=line.product_uom_qty)
+
+    bench.measure('compute_installment_amount', orders._compute_installment_amount, count)
+    bench.measure('revenue_domain', revenue_domain, count)
+    bench.measure('action_confirm', to_invoice.action_confirm, len(to_invoice))
+    half = len(to_invoice) // 2
+    bench.measure('action_invoice_create', lambda: to_invoice[:half].action_invoice_create(grouped=True), half)
+    bench.measure('action_invoice_create_bulk', lambda: to_invoice[half:].action_invoice_create_bulk(grouped=True),
+                  len(to_invoice) - half)
+    bench.measure('get_invoiced', orders._get_invoiced, count)
+    bench.measure('resolve_invoices', orders._resolve_invoices, count)
+    bench.measure('vat_compute', vat_compute, len(order_lines))
+    bench.measure('tax_amount_by_group', orders._get_tax_amount_by_group_batch, count)
+
+    categories = data['categories'].ids
+    terms = data['terms'].ids
+    bench.latency('simulate_quotes', lambda index: env['installment.sale'].simulate_quotes([{
+        'product_category_id': categories[index % len(categories)],
+        'price_unit': 100000.0 + index,
+        'deferred_revenue_id': terms[index % len(terms)],
+        'advance': 'spot',
+    }]), args.quotes)
+    return bench.results
+
+
+def compare(results, baseline, time_tolerance):
+    failures = []
+    for name in sorted(set(baseline) - set(results)):
+        failures.append("%s: in the baseline but not run" % name)
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if not reference:
+            failures.append("%s: missing from the baseline" % name)
+            continue
+        if result['queries'] > reference['queries']:
+            failures.append("%s: %d queries, baseline %d" % (name, result['queries'], reference['queries']))
+        if 'seconds' in reference and result['seconds'] > reference['seconds'] * (1 + time_tolerance):
+            failures.append("%s: %.3fs, baseline %.3fs" % (name, result['seconds'], reference['seconds']))
+        if 'p99_ms' in reference and result['p99_ms'] > reference['p99_ms'] * (1 + time_tolerance):
+            failures.append("%s: p99 %.3fms, baseline %.3fms" % (name, result['p99_ms'], reference['p99_ms']))
+    return failures
+
+
+def baseline_results(results, with_timings):
+    """ Return the figures of ``results`` kept in a baseline: query counts, and timings if asked. """
+    keys = ('queries', 'seconds', 'p99_ms') if with_timings else ('queries',)
+    return dict((name, dict((key, result[key]) for key in keys if key in result))
+                for name, result in results.items())
+
+
+def main(argv):
+    args = parse_args(argv)
+    odoo_args = ['-d', args.database] + (['-c', args.config] if args.config else [])
+    odoo.tools.config.parse_config(odoo_args)
+    volumes = dict((key, getattr(args, key)) for key in
+                   ('terms', 'categories', 'partners', 'orders', 'lines', 'invoiced', 'quotes', 'seed'))
+    registry = odoo.registry(args.database)
+    with api.Environment.manage(), registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        try:
+            results = run(env, args)
+        finally:
+            cr.rollback()
+    output = {'volumes': volumes, 'results': results}
+
+    failures = []
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'volumes': volumes, 'results': baseline_results(results, args.with_timings)}, f, indent=2,
+                      sort_keys=True)
+            f.write('\n')
+    elif not os.path.exists(BASELINE_PATH):
+        failures = ["no baseline recorded, see --update-baseline"]
+    else:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        if baseline.get('volumes') == volumes:
+            failures = compare(results, baseline['results'], args.time_tolerance)
+        else:
+            failures = ["baseline recorded with other volumes: %s" % json.dumps(baseline.get('volumes'),
+                                                                                sort_keys=True)]
+    output['failures'] = failures
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    for failure in failures:
+        sys.stderr.write("REGRESSION %s\n" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
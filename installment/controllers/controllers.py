@@ -1,20 +1,15 @@
 # -*- coding: utf-8 -*-
 from odoo import http
+from odoo.http import request
 
-# class Installment(http.Controller):
-#     @http.route('/installment/installment/', auth='public')
-#     def index(self, **kw):
-#         return "Hello, world"
 
-#     @http.route('/installment/installment/objects/', auth='public')
-#     def list(self, **kw):
-#         return http.request.render('installment.listing', {
-#             'root': '/installment/installment',
-#             'objects': http.request.env['installment.installment'].search([]),
-#         })
+class Installment(http.Controller):
 
-#     @http.route('/installment/installment/objects/<model("installment.installment"):obj>/', auth='public')
-#     def object(self, obj, **kw):
-#         return http.request.render('installment.object', {
-#             'object': obj
-#         })
\ No newline at end of file
+    @http.route('/installment/quote', type='json', auth='user')
+    def quote(self, items=None, **kw):
+        """
+        Simulate installment quotes, see ``installment.sale.simulate_quotes`` for the format of
+        ``items``. Nothing is written: a batch of quotes costs a few cached lookups and one pass
+        of the pricing engine.
+        """
+        return {'quotes': request.env['installment.sale'].simulate_quotes(items or [])}
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of the installment hot paths.
+
+Methods decorated with :func:`instrumented` record their wall time, SQL query count and number of
+records processed. It is enabled with the ``installment_instrumentation = True`` option of the
+Odoo configuration file or the ``ODOO_INSTALLMENT_INSTRUMENTATION=1`` environment variable; when
+disabled, a decorated method only pays for one boolean test.
+
+Every call is logged as one JSON line on the ``odoo.addons.installment.perf`` logger, and calls
+are aggregated per worker into latency histograms that are appended to ``installment.perf.stat``
+at most once per ``FLUSH_INTERVAL`` seconds, with a cursor of their own.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import odoo
+
+_logger = logging.getLogger(__name__)
+_perf_logger = logging.getLogger('odoo.addons.installment.perf')
+
+# upper bounds of the histogram buckets, in milliseconds
+BUCKETS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+FLUSH_INTERVAL = 60
+
+ENABLED = bool(odoo.tools.config.get('installment_instrumentation') or
+               os.environ.get('ODOO_INSTALLMENT_INSTRUMENTATION'))
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = [time.time()]
+
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def instrumented(method):
+    """ Instrument a model method; apply it below the ``api`` decorators. """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not ENABLED:
+            return method(self, *args, **kwargs)
+        cr = self.env.cr
+        queries = cr.sql_log_count
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _record(cr.dbname, '%s.%s' % (self._name, name), (time.time() - start) * 1000,
+                    cr.sql_log_count - queries, len(self))
+    return wrapper
+
+
+def _record(dbname, method, duration, queries, records):
+    _perf_logger.info(json.dumps({'db': dbname, 'method': method, 'ms': round(duration, 3), 'queries': queries,
+                                  'records': records}))
+    bucket = next((index for index, bound in enumerate(BUCKETS) if duration <= bound), len(BUCKETS))
+    with _lock:
+        stat = _stats.setdefault((dbname, method), {
+            'calls': 0, 'duration': 0.0, 'max_duration': 0.0, 'queries': 0, 'records': 0,
+            'buckets': [0] * (len(BUCKETS) + 1),
+        })
+        stat['calls'] += 1
+        stat['duration'] += duration
+        stat['max_duration'] = max(stat['max_duration'], duration)
+        stat['queries'] += queries
+        stat['records'] += records
+        stat['buckets'][bucket] += 1
+        if time.time() - _last_flush[0] < FLUSH_INTERVAL:
+            return
+        _last_flush[0] = time.time()
+        pending = dict(_stats)
+        _stats.clear()
+    flush(pending)
+
+
+def flush(pending=None):
+    """ Append the aggregated statistics to ``installment.perf.stat``, one cursor per database. """
+    if pending is None:
+        with _lock:
+            pending = dict(_stats)
+            _stats.clear()
+    by_db = {}
+    for (dbname, method), stat in pending.items():
+        by_db.setdefault(dbname, []).append((method, stat))
+    for dbname, stats in by_db.items():
+        try:
+            with odoo.api.Environment.manage(), odoo.registry(dbname).cursor() as cr:
+                env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+                env['installment.perf.stat']._store(stats)
+        except Exception:
+            _logger.warning("Could not store installment instrumentation statistics", exc_info=True)
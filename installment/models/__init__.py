@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
 
-from . import models, partner, sales, sale_line, account, deferred_revenue, account_tax, product
+from . import models, partner, sales, sale_line, account, deferred_revenue, account_tax, product, schedule, billing, perf_stat, quotation, delinquency, reprice, contract_import
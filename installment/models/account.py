@@ -4,3 +4,65 @@ class InstallmentAccountInvoice(models.Model):
     _name = 'installment.account.invoice'
     _inherit = 'account.invoice'
 
+
+class AccountInvoice(models.Model):
+    _inherit = 'account.invoice'
+
+    @api.model_cr
+    def init(self):
+        # lookups of the invoices and refunds of installment orders (see installment.sale._resolve_invoices)
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS account_invoice_origin_type_journal_index
+                            ON account_invoice (origin, type, journal_id)""")
+
+    @api.multi
+    def refund(self, date_invoice=None, date=None, description=None, journal_id=None):
+        refunds = super(AccountInvoice, self).refund(date_invoice=date_invoice, date=date, description=description,
+                                                     journal_id=journal_id)
+        refund_map = dict(zip(self.ids, refunds.ids))
+        self._cr.execute("""SELECT order_id, invoice_id FROM installment_sale_account_invoice_rel
+                            WHERE invoice_id IN %s""", (tuple(self.ids) or (0,),))
+        order_invoices = {}
+        for order_id, invoice_id in self._cr.fetchall():
+            order_invoices.setdefault(order_id, set()).add(refund_map[invoice_id])
+        self.env['installment.sale']._link_invoices(order_invoices)
+        return refunds
+
+    @api.multi
+    def action_invoice_cancel(self):
+        res = super(AccountInvoice, self).action_invoice_cancel()
+        # cancelled installments are billed again by the next billing run
+        self._cr.execute("""UPDATE installment_schedule_line
+                            SET state = 'open', invoice_id = NULL, write_date = (now() at time zone 'UTC')
+                            WHERE invoice_id IN %s AND state = 'invoiced'""", (tuple(self.ids) or (0,),))
+        self.env['installment.schedule.line'].invalidate_cache(['state', 'invoice_id'])
+        return res
+
+    @api.multi
+    def action_invoice_paid(self):
+        res = super(AccountInvoice, self).action_invoice_paid()
+        paid = self.filtered(lambda inv: inv.state == 'paid')
+        if paid:
+            self._cr.execute("""UPDATE installment_schedule_line
+                                SET state = 'paid', write_date = (now() at time zone 'UTC')
+                                WHERE invoice_id IN %s AND state = 'invoiced'""", (tuple(paid.ids),))
+            self.env['installment.schedule.line'].invalidate_cache(['state'])
+        return res
+
+    @api.multi
+    def action_invoice_re_open(self):
+        res = super(AccountInvoice, self).action_invoice_re_open()
+        # installments of invoices whose payment was unreconciled are due again
+        self._cr.execute("""UPDATE installment_schedule_line
+                            SET state = 'invoiced', write_date = (now() at time zone 'UTC')
+                            WHERE invoice_id IN %s AND state = 'paid'""", (tuple(self.ids) or (0,),))
+        self.env['installment.schedule.line'].invalidate_cache(['state'])
+        return res
+
+    @api.multi
+    def unlink(self):
+        self._cr.execute("""SELECT DISTINCT order_id FROM installment_sale_account_invoice_rel
+                            WHERE invoice_id IN %s""", (tuple(self.ids) or (0,),))
+        order_ids = [row[0] for row in self._cr.fetchall()]
+        res = super(AccountInvoice, self).unlink()
+        self.env['installment.sale']._update_invoice_count(order_ids)
+        return res
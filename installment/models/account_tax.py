@@ -1,4 +1,12 @@
-from odoo import api, fields, models , _
+from odoo import api, fields, models, tools, _
+from odoo.tools.lru import LRU
+
+from ..instrumentation import instrumented
+
+# results of vat_compute for cacheable taxes, per worker; entries are keyed on the registry cache
+# sequence, so that the taxes written in other workers are not served from a stale entry
+_vat_cache = LRU(8192)
+
 
 class AccountTax(models.Model):
     _inherit = 'account.tax'
@@ -12,6 +20,39 @@ class AccountTax(models.Model):
             return (base_amount / (1 + (self.amount / 100))) * (self.amount / 100)
         return tax
 
+    @api.model
+    @tools.ormcache('company_id', 'tax_ids')
+    def _get_vat_plan(self, company_id, tax_ids):
+        """
+        Compile the taxes ``tax_ids`` for :meth:`vat_compute`: taxes sorted by sequence with the
+        flags and accounts used by the computation, group children resolved, and the rounding
+        settings of the company. Cached in the registry, cleared when taxes or companies change.
+        """
+        company = self.env['res.company'].browse(company_id)
+        entries = []
+        cacheable = True
+        for tax in self.browse(tax_ids).sorted(key=lambda r: r.sequence):
+            if tax.amount_type == 'code' or any(child.amount_type == 'code' for child in tax.children_tax_ids):
+                # python taxes may depend on the product and partner, their results are never cached
+                cacheable = False
+            entries.append(tools.frozendict({
+                'id': tax.id,
+                'amount_type': tax.amount_type,
+                'children_tax_ids': tuple(tax.children_tax_ids.ids),
+                'price_include': tax.price_include,
+                'include_base_amount': tax.include_base_amount,
+                'sequence': tax.sequence,
+                'account_id': tax.account_id.id,
+                'refund_account_id': tax.refund_account_id.id,
+                'analytic': tax.analytic,
+            }))
+        return tools.frozendict({
+            'taxes': tuple(entries),
+            'round_tax': company.tax_calculation_rounding_method != 'round_globally',
+            'cacheable': cacheable,
+        })
+
+    @instrumented
     def vat_compute(self, price_unit, currency=None, quantity=1.0, product=None, partner=None):
         if len(self) == 0:
             company_id = self.env.user.company_id
@@ -19,43 +60,65 @@ class AccountTax(models.Model):
             company_id = self[0].company_id
         if not currency:
             currency = company_id.currency_id
+        plan = self._get_vat_plan(company_id.id, tuple(self.ids))
+        round_ctx = bool(self.env.context['round']) if 'round' in self.env.context else None
+        base_values = self.env.context.get('base_values')
+        lang = partner.lang if partner else self.env.context.get('lang')
+        if plan['cacheable']:
+            key = (self._cr.dbname, getattr(self.pool, 'cache_sequence', None), tuple(self.ids), company_id.id,
+                   price_unit, quantity, currency.id, currency.rounding, currency.decimal_places, lang, round_ctx,
+                   tuple(base_values) if base_values else None)
+            res = _vat_cache.get(key)
+            if res is None:
+                res = _vat_cache[key] = self.with_context(lang=lang)._vat_compute(
+                    plan, price_unit, currency, quantity, None, None, lang, round_ctx, base_values)
+        else:
+            res = self._vat_compute(plan, price_unit, currency, quantity, product, partner, lang, round_ctx,
+                                    base_values)
+        # results may be shared through the cache, callers get their own copy
+        return dict(res, taxes=[dict(tax) for tax in res['taxes']])
+
+    @api.model
+    def _vat_compute(self, plan, price_unit, currency, quantity, product, partner, lang, round_ctx, base_values):
+        """ Evaluate a plan compiled by :meth:`_get_vat_plan`. """
         taxes = []
         prec = currency.decimal_places
 
-
-        round_tax = False if company_id.tax_calculation_rounding_method == 'round_globally' else True
+        round_tax = plan['round_tax']
         round_total = True
-        if 'round' in self.env.context:
-            round_tax = bool(self.env.context['round'])
-            round_total = bool(self.env.context['round'])
+        if round_ctx is not None:
+            round_tax = bool(round_ctx)
+            round_total = bool(round_ctx)
 
         if not round_tax:
             prec += 5
 
-        base_values = self.env.context.get('base_values')
         if not base_values:
             total_excluded = total_included = base = round(price_unit * quantity, prec)
         else:
             total_excluded, total_included, base = base_values
 
-        for tax in self.sorted(key=lambda r: r.sequence):
-            if tax.amount_type == 'group':
-                children = tax.children_tax_ids.with_context(base_values=(total_excluded, total_included, base))
+        tax_ids = [entry['id'] for entry in plan['taxes']]
+        names = dict((tax.id, tax.name) for tax in self.browse(tax_ids).with_context(lang=lang))
+
+        for entry in plan['taxes']:
+            if entry['amount_type'] == 'group':
+                children = self.browse(entry['children_tax_ids']).with_context(
+                    base_values=(total_excluded, total_included, base))
                 ret = children.compute_all(price_unit, currency, quantity, product, partner)
                 total_excluded = ret['total_excluded']
-                base = ret['base'] if tax.include_base_amount else base
+                base = ret['base'] if entry['include_base_amount'] else base
                 total_included = ret['total_included']
-                tax_amount = total_included - total_excluded
                 taxes += ret['taxes']
                 continue
 
-            tax_amount = tax._compute_amount(base, price_unit, quantity, product, partner)
+            tax_amount = self.browse(entry['id'])._compute_amount(base, price_unit, quantity, product, partner)
             if not round_tax:
                 tax_amount = round(tax_amount, prec)
             else:
                 tax_amount = currency.round(tax_amount)
 
-            if tax.price_include:
+            if entry['price_include']:
                 total_excluded -= tax_amount
                 base -= tax_amount
             else:
@@ -64,18 +127,18 @@ class AccountTax(models.Model):
             # Keep base amount used for the current tax
             tax_base = base
 
-            if tax.include_base_amount:
+            if entry['include_base_amount']:
                 base += tax_amount
 
             taxes.append({
-                'id': tax.id,
-                'name': tax.with_context(**{'lang': partner.lang} if partner else {}).name,
+                'id': entry['id'],
+                'name': names[entry['id']],
                 'amount': tax_amount,
                 'base': tax_base,
-                'sequence': tax.sequence,
-                'account_id': tax.account_id.id,
-                'refund_account_id': tax.refund_account_id.id,
-                'analytic': tax.analytic,
+                'sequence': entry['sequence'],
+                'account_id': entry['account_id'],
+                'refund_account_id': entry['refund_account_id'],
+                'analytic': entry['analytic'],
             })
 
         return {
@@ -84,3 +147,49 @@ class AccountTax(models.Model):
             'total_included': currency.round(total_included) if round_total else total_included,
             'base': base,
         }
+
+    @api.model
+    def create(self, vals):
+        res = super(AccountTax, self).create(vals)
+        self.clear_caches()
+        _vat_cache.clear()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        res = super(AccountTax, self).write(vals)
+        self.clear_caches()
+        _vat_cache.clear()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(AccountTax, self).unlink()
+        self.clear_caches()
+        _vat_cache.clear()
+        return res
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResCompany, self).write(vals)
+        if 'tax_calculation_rounding_method' in vals:
+            # compiled VAT plans embed the rounding method
+            self.env['account.tax'].clear_caches()
+            _vat_cache.clear()
+        return res
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResCurrency, self).write(vals)
+        if 'rounding' in vals:
+            # cached VAT results are rounded to the currency
+            _vat_cache.clear()
+        return res
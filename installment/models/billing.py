@@ -0,0 +1,173 @@
+import logging
+import time
+
+from odoo import api, fields, models, _
+
+_logger = logging.getLogger(__name__)
+
+BILLING_CHUNK_SIZE = 200
+# first key of the advisory locks the billing workers hold on their run, the second one is the run id
+BILLING_RUN_LOCK = 7306
+
+
+class InstallmentBillingRun(models.Model):
+    _name = 'installment.billing.run'
+    _description = 'Installment Billing Run'
+    _order = 'date desc, id desc'
+
+    name = fields.Char('Name', compute='_compute_name')
+    date = fields.Date('Billing Date', required=True, readonly=True, index=True)
+    state = fields.Selection([('running', 'Running'), ('done', 'Done')], string='Status', default='running',
+                             readonly=True)
+    date_start = fields.Datetime('Started', readonly=True)
+    date_end = fields.Datetime('Finished', readonly=True)
+    chunk_ids = fields.One2many('installment.billing.run.chunk', 'run_id', 'Chunks', readonly=True)
+    line_count = fields.Integer('Installments Billed', compute='_compute_totals')
+    order_count = fields.Integer('Orders Billed', readonly=True)
+    failed_count = fields.Integer('Installments Failed', compute='_compute_totals')
+    duration = fields.Float('Processing Time (s)', compute='_compute_totals')
+    throughput = fields.Float('Throughput (orders/s)', readonly=True)
+
+    _sql_constraints = [
+        ('date_uniq', 'unique(date)', 'There is already a billing run for this date.'),
+    ]
+
+    @api.depends('date')
+    def _compute_name(self):
+        for run in self:
+            run.name = _('Billing of %s') % run.date
+
+    @api.depends('chunk_ids')
+    def _compute_totals(self):
+        for run in self:
+            run.line_count = sum(run.chunk_ids.mapped('line_count'))
+            run.failed_count = sum(run.chunk_ids.mapped('failed_count'))
+            run.duration = sum(run.chunk_ids.mapped('duration'))
+
+    @api.model
+    def _get_run(self, date):
+        """ Return the run of the billing date, creating it if needed (concurrency-safe). """
+        self.env.cr.execute("""
+            INSERT INTO installment_billing_run (date, state, date_start, create_uid, create_date, write_uid, write_date)
+            VALUES (%s, 'running', (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))
+            ON CONFLICT (date) DO NOTHING
+        """, (date, self.env.uid, self.env.uid))
+        return self.search([('date', '=', date)], limit=1)
+
+    @api.model
+    def _select_due_lines(self, date, limit, exclude_ids):
+        """
+        Lock and return up to ``limit`` due installments. Rows locked by another billing worker are
+        skipped, so concurrent workers always process disjoint chunks.
+        """
+        self.env.cr.execute("""
+            SELECT line.id
+            FROM installment_schedule_line line
+            JOIN installment_sale sale ON sale.id = line.order_id
+            WHERE line.state = 'open' AND line.due_date <= %s AND sale.state IN ('sale', 'done')
+              AND line.id NOT IN %s
+            ORDER BY line.due_date, line.id
+            LIMIT %s
+            FOR UPDATE OF line SKIP LOCKED
+        """, (date, tuple(exclude_ids) or (0,), limit))
+        return self.env['installment.schedule.line'].browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _cron_bill_due_installments(self, chunk_size=BILLING_CHUNK_SIZE, validate=True):
+        """
+        Bill the due installments of confirmed orders, one committed chunk at a time. Several
+        cron jobs may run this method concurrently; an interrupted run resumes with the
+        installments that are still open when it is started again.
+        """
+        # the changes of the orders are tracked as one message per order and chunk
+        self = self.with_context(installment_tracking='summary')
+        Order = self.env['installment.sale']
+        cr = self.env.cr
+        date = fields.Date.context_today(self)
+        run = self._get_run(date)
+        if run.state == 'done':
+            run.write({'state': 'running', 'date_start': fields.Datetime.now(), 'date_end': False})
+        # every worker holds a shared lock on the run while it bills; session locks survive the
+        # commits of the chunks and are released by the database if the worker dies
+        cr.execute("SELECT pg_advisory_lock_shared(%s, %s)", (BILLING_RUN_LOCK, run.id))
+        cr.commit()
+
+        try:
+            failed_ids = set()
+            while True:
+                lines = self._select_due_lines(date, chunk_size, failed_ids)
+                if not lines:
+                    break
+                start = time.time()
+                try:
+                    lines._create_invoices(validate=validate)
+                    failed = 0
+                except Exception:
+                    cr.rollback()
+                    self.env.clear()
+                    Order._discard_tracking()
+                    _logger.exception("Installment billing failed for schedule lines %s", lines.ids)
+                    failed_ids.update(lines.ids)
+                    failed = len(lines)
+                    lines = lines.browse()
+                self.env['installment.billing.run.chunk'].create({
+                    'run_id': run.id,
+                    'line_count': len(lines),
+                    'order_count': len(lines.mapped('order_id')),
+                    'failed_count': failed,
+                    'duration': time.time() - start,
+                })
+                Order._flush_tracking()
+                cr.commit()
+                self.invalidate_cache()
+        finally:
+            cr.rollback()
+            Order._discard_tracking()
+            cr.execute("SELECT pg_advisory_unlock_shared(%s, %s)", (BILLING_RUN_LOCK, run.id))
+
+        # the run is closed by the last worker to finish: only it gets the exclusive lock
+        cr.execute("SELECT pg_try_advisory_lock(%s, %s)", (BILLING_RUN_LOCK, run.id))
+        if cr.fetchone()[0]:
+            try:
+                run.invalidate_cache()
+                run._finish()
+                cr.commit()
+            finally:
+                cr.execute("SELECT pg_advisory_unlock(%s, %s)", (BILLING_RUN_LOCK, run.id))
+        return True
+
+    @api.multi
+    def _finish(self):
+        """
+        Close the run and report its throughput: the distinct orders billed since the run started,
+        over its wall-clock time.
+        """
+        for run in self:
+            date_end = fields.Datetime.now()
+            self.env.cr.execute("""
+                SELECT count(DISTINCT line.order_id)
+                FROM installment_schedule_line line
+                JOIN account_invoice inv ON inv.id = line.invoice_id
+                WHERE line.due_date <= %s AND inv.create_date >= %s
+            """, (run.date, run.date_start or date_end))
+            order_count = self.env.cr.fetchone()[0]
+            elapsed = (fields.Datetime.from_string(date_end) -
+                       fields.Datetime.from_string(run.date_start or date_end)).total_seconds()
+            throughput = order_count / elapsed if elapsed else 0.0
+            run.write({'state': 'done', 'date_end': date_end, 'order_count': order_count, 'throughput': throughput})
+            _logger.info("Installment billing run %s done: %d installments of %d orders billed, %d failed, "
+                         "%.2fs, %.2f orders/s", run.date, run.line_count, order_count, run.failed_count,
+                         elapsed, throughput)
+
+
+class InstallmentBillingRunChunk(models.Model):
+    _name = 'installment.billing.run.chunk'
+    _description = 'Installment Billing Run Chunk'
+    _order = 'id'
+
+    run_id = fields.Many2one('installment.billing.run', 'Billing Run', required=True, index=True,
+                             ondelete='cascade')
+    line_count = fields.Integer('Installments Billed')
+    order_count = fields.Integer('Orders Billed')
+    failed_count = fields.Integer('Installments Failed')
+    duration = fields.Float('Processing Time (s)')
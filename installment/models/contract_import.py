@@ -0,0 +1,302 @@
+import base64
+import csv
+import logging
+import tempfile
+import time
+from itertools import groupby
+
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = ['name', 'partner', 'date_order', 'product', 'price_unit', 'quantity', 'purchase_term', 'advance',
+                  'state', 'confirmation_date']
+MAX_LOGGED_ERRORS = 1000
+# size of the base64 blocks decoded at a time when the upload is stored in the database
+DECODE_BLOCK_SIZE = 1024 * 1024
+
+
+class InstallmentImportJob(models.Model):
+    """
+    Streaming import of legacy installment contracts from a CSV file with the columns of
+    ``IMPORT_COLUMNS`` (``advance``, ``state`` and ``confirmation_date`` are optional). Consecutive
+    rows with the same ``name`` are the lines of one contract. ``partner`` is matched on the
+    partner reference, then on its name; ``product`` on the internal reference.
+
+    The import is queued and processed by a cron job, one committed chunk of contracts at a
+    time; an interrupted or failed job resumes after its last committed chunk.
+    """
+    _name = 'installment.import.job'
+    _description = 'Installment Contract Import'
+    _order = 'id desc'
+
+    name = fields.Char('File Name', readonly=True, states={'pending': [('readonly', False)]})
+    data_file = fields.Binary('CSV File', attachment=True, readonly=True, states={'pending': [('readonly', False)]})
+    delimiter = fields.Char('Delimiter', default=',', required=True, size=1, readonly=True,
+                            states={'pending': [('readonly', False)]})
+    chunk_size = fields.Integer('Contracts per Chunk', default=500, required=True, readonly=True,
+                                states={'pending': [('readonly', False)]})
+    state = fields.Selection([('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+                             string='Status', default='pending', required=True, readonly=True, index=True)
+    last_line = fields.Integer('Last Imported Line', readonly=True,
+                               help="Last line of the last committed chunk; a restarted job resumes after it.")
+    chunk_ids = fields.One2many('installment.import.job.chunk', 'job_id', 'Chunks', readonly=True)
+    row_count = fields.Integer('Rows Imported', compute='_compute_totals')
+    order_count = fields.Integer('Contracts Imported', compute='_compute_totals')
+    error_count = fields.Integer('Rows Rejected', compute='_compute_totals')
+    duration = fields.Float('Processing Time (s)', compute='_compute_totals')
+    rows_per_second = fields.Float('Rows per Second', compute='_compute_totals')
+    date_start = fields.Datetime('Started', readonly=True)
+    date_end = fields.Datetime('Finished', readonly=True)
+    error = fields.Text('Error', readonly=True)
+
+    @api.depends('chunk_ids')
+    def _compute_totals(self):
+        for job in self:
+            job.row_count = sum(job.chunk_ids.mapped('row_count'))
+            job.order_count = sum(job.chunk_ids.mapped('order_count'))
+            job.error_count = sum(job.chunk_ids.mapped('error_count'))
+            job.duration = sum(job.chunk_ids.mapped('duration'))
+            job.rows_per_second = job.row_count / job.duration if job.duration else 0.0
+
+    @api.model
+    def create(self, vals):
+        if not vals.get('data_file'):
+            raise UserError(_('Please select a file to import.'))
+        return super(InstallmentImportJob, self).create(vals)
+
+    @api.multi
+    def action_retry(self):
+        """ Resume failed jobs after their last committed chunk. """
+        self.filtered(lambda job: job.state == 'failed').write({'state': 'running', 'error': False,
+                                                                'date_end': False})
+        return True
+
+    @api.model
+    def _cron_process_jobs(self):
+        """ Run the pending and interrupted jobs, oldest first, committing after each chunk. """
+        cr = self.env.cr
+        for job in self.search([('state', 'in', ('pending', 'running'))], order='id'):
+            try:
+                job._run()
+            except Exception as e:
+                cr.rollback()
+                self.env.clear()
+                _logger.exception("Installment import job %s failed", job.id)
+                job.write({'state': 'failed', 'error': tools.ustr(e), 'date_end': fields.Datetime.now()})
+                cr.commit()
+        return True
+
+    @api.multi
+    def _run(self):
+        """
+        Import the contracts of the file without loading it in memory: contracts are read,
+        resolved and created ``chunk_size`` at a time, and each chunk is committed with its
+        statistics. The contracts up to ``last_line`` were imported by a previous run and are
+        skipped.
+        """
+        self.ensure_one()
+        cr = self.env.cr
+        if self.state == 'pending':
+            self.write({'state': 'running', 'date_start': fields.Datetime.now()})
+            cr.commit()
+        with self._open_data_file() as fileobj:
+            reader = csv.DictReader(fileobj, delimiter=str(self.delimiter))
+            missing = set(IMPORT_COLUMNS[:7]) - set(reader.fieldnames or [])
+            if missing:
+                raise UserError(_('Missing columns in the file: %s') % ', '.join(sorted(missing)))
+            rows = ((reader.line_num, dict((key, tools.ustr(value or '').strip()) for key, value in row.items()))
+                    for row in reader)
+            contracts = ((name, list(lines)) for name, lines in groupby(rows, key=lambda row: row[1]['name']))
+            chunk = []
+            for contract in contracts:
+                if contract[1][-1][0] <= self.last_line:
+                    continue
+                chunk.append(contract)
+                if len(chunk) >= self.chunk_size:
+                    self._import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self._import_chunk(chunk)
+        # the file is not needed anymore once imported
+        self.write({'state': 'done', 'date_end': fields.Datetime.now(), 'data_file': False})
+        cr.commit()
+        _logger.info("Installment import %s: %d rows, %d contracts, %d rejected rows in %.2fs (%.1f rows/s)",
+                     self.id, self.row_count, self.order_count, self.error_count, self.duration,
+                     self.rows_per_second)
+
+    @api.multi
+    def _open_data_file(self):
+        """
+        Return a file object on the uploaded file, which is stored as an attachment: it is read
+        from the filestore, or decoded into a temporary file block by block when attachments are
+        stored in the database, without holding the whole file in memory.
+        """
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name), ('res_field', '=', 'data_file'), ('res_id', '=', self.id)], limit=1)
+        if not attachment:
+            raise UserError(_('The file to import is missing.'))
+        if attachment.store_fname:
+            return open(attachment._full_path(attachment.store_fname), 'rb')
+        data = attachment.db_datas or b''
+        fileobj = tempfile.TemporaryFile()
+        pending = b''
+        for offset in range(0, len(data), DECODE_BLOCK_SIZE):
+            pending += b''.join(data[offset:offset + DECODE_BLOCK_SIZE].split())
+            usable = len(pending) - len(pending) % 4
+            fileobj.write(base64.b64decode(pending[:usable]))
+            pending = pending[usable:]
+        fileobj.seek(0)
+        return fileobj
+
+    @api.model
+    def _resolve_chunk(self, chunk):
+        """ Return the partner and product lookup tables of a chunk, resolved in a few queries. """
+        partner_keys = set(row['partner'] for name, lines in chunk for line_num, row in lines)
+        product_codes = set(row['product'] for name, lines in chunk for line_num, row in lines)
+        partners = {}
+        Partner = self.env['res.partner'].with_context(active_test=False)
+        for partner in Partner.search([('ref', 'in', list(partner_keys))]):
+            partners.setdefault(partner.ref, partner)
+        names = list(partner_keys - set(partners))
+        if names:
+            for partner in Partner.search([('name', 'in', names)]):
+                partners.setdefault(partner.name, partner)
+        products = {}
+        for product in self.env['product.product'].search([('default_code', 'in', list(product_codes))]):
+            products.setdefault(product.default_code, product)
+        return partners, products
+
+    @api.model
+    def _prepare_order(self, name, lines, partners, products, terms_by_name):
+        """ Validate the rows of a contract and return the values of its order. """
+        first = lines[0][1]
+        partner = partners.get(first['partner'])
+        if not partner:
+            raise ValueError(_('Unknown customer "%s"') % first['partner'])
+        term_id = terms_by_name.get(first['purchase_term'])
+        if not term_id:
+            raise ValueError(_('Unknown purchase term "%s"') % first['purchase_term'])
+        order_lines = []
+        categ = None
+        for line_num, row in lines:
+            product = products.get(row['product'])
+            if not product:
+                raise ValueError(_('Unknown product "%s"') % row['product'])
+            categ = categ or product.categ_id
+            order_lines.append((0, 0, {
+                'product_id': product.id,
+                'name': product.display_name,
+                'product_uom': product.uom_id.id,
+                'product_uom_qty': float(row['quantity'] or 1.0),
+                'price_unit': float(row['price_unit']),
+            }))
+        while categ.parent_id:
+            categ = categ.parent_id
+        state = first.get('state') or 'draft'
+        if state not in ('draft', 'sale'):
+            raise ValueError(_('Unsupported state "%s"') % state)
+        advance = first.get('advance')
+        return {
+            'name': name,
+            'partner_id': partner.id,
+            'partner_invoice_id': partner.id,
+            'partner_shipping_id': partner.id,
+            'pricelist_id': partner.property_product_pricelist.id,
+            'date_order': first['date_order'] or fields.Datetime.now(),
+            'product_category_id': categ.id,
+            'purchase_type': 'install',
+            'deferred_revenue_id': term_id,
+            'is_spot_advance': advance == 'spot',
+            'is_deferred_advance': advance == 'deferred',
+            'state': state,
+            'confirmation_date': (first.get('confirmation_date') or first['date_order'] or fields.Datetime.now())
+            if state == 'sale' else False,
+            'order_line': order_lines,
+        }
+
+    @api.multi
+    def _import_chunk(self, chunk):
+        """
+        Create the contracts of a chunk with tracking disabled and recomputations deferred to the
+        end of the chunk, then commit them with the statistics of the chunk. If the chunk fails,
+        its contracts are created again one by one so that only the faulty ones are rejected.
+        """
+        self.ensure_one()
+        start = time.time()
+        stats = {'row_count': 0, 'order_count': 0, 'error_count': 0, 'errors': []}
+        partners, products = self._resolve_chunk(chunk)
+        terms = self.env['deferred.revenue.custom']._get_term_table()['terms']
+        terms_by_name = dict((term['name'], term_id) for term_id, term in terms.items())
+        Order = self.env['installment.sale'].with_context(installment_tracking='off', mail_create_nolog=True)
+        values = []
+        for name, lines in chunk:
+            try:
+                values.append((name, lines, self._prepare_order(name, lines, partners, products, terms_by_name)))
+            except (ValueError, TypeError) as e:
+                self._log_error(stats, lines, tools.ustr(e))
+
+        try:
+            with self.env.cr.savepoint():
+                orders = self._create_orders(Order, [vals for name, lines, vals in values])
+        except Exception:
+            # drop the cache and the pending recomputations of the rolled back contracts
+            self.env.clear()
+            orders = Order.browse()
+            for name, lines, vals in values:
+                try:
+                    with self.env.cr.savepoint():
+                        orders |= self._create_orders(Order, [vals])
+                except Exception as e:
+                    self.env.clear()
+                    self._log_error(stats, lines, tools.ustr(e))
+                    values = [value for value in values if value[0] != name]
+        stats['order_count'] += len(orders)
+        stats['row_count'] += sum(len(lines) for name, lines, vals in values)
+        last_line = chunk[-1][1][-1][0]
+        self.env['installment.import.job.chunk'].create({
+            'job_id': self.id,
+            'first_line': chunk[0][1][0][0],
+            'last_line': last_line,
+            'row_count': stats['row_count'],
+            'order_count': stats['order_count'],
+            'error_count': stats['error_count'],
+            'error_log': '\n'.join(_('Line %d: %s') % error for error in stats['errors']) or False,
+            'duration': time.time() - start,
+        })
+        self.write({'last_line': last_line})
+        self.env.cr.commit()
+        self.env.invalidate_all()
+
+    @api.model
+    def _create_orders(self, Order, vals_list):
+        orders = Order.browse()
+        with self.env.norecompute():
+            for vals in vals_list:
+                orders |= Order.create(vals)
+        orders.recompute()
+        orders.filtered(lambda order: order.state == 'sale')._generate_schedule()
+        return orders
+
+    @api.model
+    def _log_error(self, stats, lines, message):
+        stats['error_count'] += len(lines)
+        if len(stats['errors']) < MAX_LOGGED_ERRORS:
+            stats['errors'].append((lines[0][0], message))
+
+
+class InstallmentImportJobChunk(models.Model):
+    _name = 'installment.import.job.chunk'
+    _description = 'Installment Contract Import Chunk'
+    _order = 'id'
+
+    job_id = fields.Many2one('installment.import.job', 'Import', required=True, index=True, ondelete='cascade')
+    first_line = fields.Integer('First Line')
+    last_line = fields.Integer('Last Line')
+    row_count = fields.Integer('Rows Imported')
+    order_count = fields.Integer('Contracts Imported')
+    error_count = fields.Integer('Rows Rejected')
+    error_log = fields.Text('Errors')
+    duration = fields.Float('Processing Time (s)')
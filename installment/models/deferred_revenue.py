@@ -1,4 +1,12 @@
-from odoo import api, fields, models, _
+from odoo import api, fields, models, tools, _
+
+from .reprice import REPRICE_TERM_FIELDS, REPRICE_CATEGORY_FIELDS
+
+TERM_FIELDS = ['name', 'number_of_months', 'purchase_type', 'spot_adv_discount', 'deferred_adv_discount',
+               'deferred_adv_count']
+TERM_CATEGORY_FIELDS = ['deferred_revenue_id', 'product_category_id', 'interest_type', 'interest_rate',
+                        'advance_payment_type', 'advance_payment']
+
 
 class DeferredRevenue(models.Model):
     _name = 'deferred.revenue.custom'
@@ -13,13 +21,102 @@ class DeferredRevenue(models.Model):
     deferred_adv_discount = fields.Float(default=0.0, string='Deferred Advances')
     deferred_adv_count = fields.Integer(default=0, string='Deferred Advances Count')
 
+    @api.model
+    @tools.ormcache()
+    def _get_term_table(self):
+        """
+        Return the whole purchase term table, cached per database in the registry:
+        - ``terms``: ``{term_id: values}``
+        - ``categories``: ``{(product_category_id, term_id): values}`` (lowest row id wins)
+        - ``eligible_terms``: ``{(product_category_id, purchase_type): [term ids]}``, the terms
+          covering a category, in the order of their category rows
+
+        The cache is cleared (in every worker) whenever a term or a term category is created,
+        written or unlinked. The returned structures are shared and must not be modified.
+        """
+        terms = {}
+        for row in self.sudo().search_read([], TERM_FIELDS, order='id'):
+            terms[row['id']] = tools.frozendict(row)
+        categories = {}
+        eligible_terms = {}
+        for row in self.env['deferred.revenue.category'].sudo().search_read([], TERM_CATEGORY_FIELDS, order='id'):
+            categ_id = row['product_category_id'] and row['product_category_id'][0]
+            term_id = row['deferred_revenue_id'] and row['deferred_revenue_id'][0]
+            values = dict(row, product_category_id=categ_id, deferred_revenue_id=term_id)
+            categories.setdefault((categ_id, term_id), tools.frozendict(values))
+            if term_id in terms:
+                eligible = eligible_terms.setdefault((categ_id, terms[term_id]['purchase_type']), [])
+                if term_id not in eligible:
+                    eligible.append(term_id)
+        return tools.frozendict({
+            'terms': tools.frozendict(terms),
+            'categories': tools.frozendict(categories),
+            'eligible_terms': tools.frozendict((key, tuple(ids)) for key, ids in eligible_terms.items()),
+        })
+
+    @api.model
+    def _get_eligible_terms(self, product_category_id, purchase_type):
+        """ Return the ids of the terms available for a product category and a purchase type. """
+        return self._get_term_table()['eligible_terms'].get((product_category_id, purchase_type), ())
+
+    @api.model
+    def create(self, vals):
+        res = super(DeferredRevenue, self).create(vals)
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        res = super(DeferredRevenue, self).write(vals)
+        self.clear_caches()
+        if REPRICE_TERM_FIELDS.intersection(vals):
+            self.env['installment.reprice.job'].sudo()._enqueue([(term.id, False) for term in self])
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(DeferredRevenue, self).unlink()
+        self.clear_caches()
+        return res
+
+
 class DeferredRevenueCategory(models.Model):
     _name = 'deferred.revenue.category'
 
     deferred_revenue_id = fields.Many2one('deferred.revenue.custom')
     product_category_id = fields.Many2one('product.category', string='Category')
     interest_type = fields.Selection([('simple', 'Simple'), ('compound', 'Compound')], default='simple')
-    interest_rate = fields.Float(string='Interest rate (%)')
+    interest_rate = fields.Float(string='Interest rate (%)',
+                                 help="Simple interest: flat rate applied once to the balance, whatever the "
+                                      "number of months. Compound interest: yearly rate, compounded monthly.")
     advance_payment_type = fields.Selection([('perc', '% of Selling Price'), ('fix', 'Fixed'), ('none', 'None')], default='perc', string='Advance Payment')
     advance_payment = fields.Float(default=0.0)
 
+    @api.multi
+    def _reprice_keys(self):
+        return [(row.deferred_revenue_id.id, row.product_category_id.id) for row in self]
+
+    @api.model
+    def create(self, vals):
+        res = super(DeferredRevenueCategory, self).create(vals)
+        self.clear_caches()
+        self.env['installment.reprice.job'].sudo()._enqueue(res._reprice_keys())
+        return res
+
+    @api.multi
+    def write(self, vals):
+        keys = self._reprice_keys() if REPRICE_CATEGORY_FIELDS.intersection(vals) else []
+        res = super(DeferredRevenueCategory, self).write(vals)
+        self.clear_caches()
+        if keys:
+            # both the quotations priced with the previous and with the new values
+            self.env['installment.reprice.job'].sudo()._enqueue(keys + self._reprice_keys())
+        return res
+
+    @api.multi
+    def unlink(self):
+        keys = self._reprice_keys()
+        res = super(DeferredRevenueCategory, self).unlink()
+        self.clear_caches()
+        self.env['installment.reprice.job'].sudo()._enqueue(keys)
+        return res
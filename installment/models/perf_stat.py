@@ -0,0 +1,52 @@
+import os
+
+from odoo import api, fields, models
+
+from .. import instrumentation
+
+
+class InstallmentPerfStat(models.Model):
+    """ Latency histograms of the instrumented installment methods, appended by each worker. """
+    _name = 'installment.perf.stat'
+    _description = 'Installment Performance Statistics'
+    _order = 'id desc'
+    _rec_name = 'method'
+
+    method = fields.Char('Method', required=True, index=True, readonly=True)
+    pid = fields.Integer('Worker', readonly=True)
+    calls = fields.Integer('Calls', readonly=True, group_operator='sum')
+    duration = fields.Float('Total Time (ms)', readonly=True, group_operator='sum')
+    max_duration = fields.Float('Max Time (ms)', readonly=True, group_operator='max')
+    avg_duration = fields.Float('Avg Time (ms)', compute='_compute_avg', readonly=True)
+    queries = fields.Integer('SQL Queries', readonly=True, group_operator='sum')
+    records = fields.Integer('Records Processed', readonly=True, group_operator='sum')
+    bucket_1 = fields.Integer('<= 1 ms', readonly=True)
+    bucket_5 = fields.Integer('<= 5 ms', readonly=True)
+    bucket_10 = fields.Integer('<= 10 ms', readonly=True)
+    bucket_50 = fields.Integer('<= 50 ms', readonly=True)
+    bucket_100 = fields.Integer('<= 100 ms', readonly=True)
+    bucket_500 = fields.Integer('<= 500 ms', readonly=True)
+    bucket_1000 = fields.Integer('<= 1 s', readonly=True)
+    bucket_5000 = fields.Integer('<= 5 s', readonly=True)
+    bucket_slow = fields.Integer('> 5 s', readonly=True)
+
+    @api.depends('calls', 'duration')
+    def _compute_avg(self):
+        for stat in self:
+            stat.avg_duration = stat.duration / stat.calls if stat.calls else 0.0
+
+    @api.model
+    def _store(self, stats):
+        bucket_fields = ['bucket_%d' % bound for bound in instrumentation.BUCKETS] + ['bucket_slow']
+        for method, stat in stats:
+            vals = dict(zip(bucket_fields, stat['buckets']))
+            vals.update({
+                'method': method,
+                'pid': os.getpid(),
+                'calls': stat['calls'],
+                'duration': stat['duration'],
+                'max_duration': stat['max_duration'],
+                'queries': stat['queries'],
+                'records': stat['records'],
+            })
+            self.create(vals)
@@ -0,0 +1,186 @@
+import base64
+import logging
+import re
+import tempfile
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+import odoo
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
+
+from ..instrumentation import instrumented
+
+_logger = logging.getLogger(__name__)
+
+QUOTATION_REPORT = 'sale.report_saleorder'
+QUOTATION_WORKERS = 4
+
+
+def _render_pdf(args):
+    """ Render the quotation of one order with a cursor of its own (runs in a pool thread). """
+    dbname, uid, context, order_id, sale_order_id = args
+    try:
+        with api.Environment.manage(), odoo.registry(dbname).cursor() as cr:
+            env = api.Environment(cr, uid, context)
+            return order_id, env['report'].get_pdf([sale_order_id], QUOTATION_REPORT)
+    except Exception:
+        _logger.exception("Could not render the quotation of installment order %s", order_id)
+        return order_id, None
+
+
+class InstallmentSales(models.Model):
+    _inherit = 'installment.sale'
+
+    @api.multi
+    def _quotation_attachment_name(self):
+        """ Name of the cached quotation PDF of the order, which changes whenever the order does. """
+        self.ensure_one()
+        return 'quotation-%d-%s.pdf' % (self.id, re.sub(r'\D', '', self.write_date or ''))
+
+    @api.multi
+    @instrumented
+    def _render_quotations(self, workers=QUOTATION_WORKERS):
+        """
+        Return the quotation PDFs of the orders as ``{order_id: attachment}``. PDFs are cached as
+        attachments of the orders named after their id and ``write_date``, so unchanged orders are
+        never rendered twice. Missing PDFs are rendered by ``workers`` threads, each with its own
+        cursor: they only see committed data. Orders that fail to render are left out.
+        """
+        names = dict((order.id, order._quotation_attachment_name()) for order in self)
+        Attachment = self.env['ir.attachment']
+        attachments = {}
+        for attachment in Attachment.search([('res_model', '=', self._name), ('res_id', 'in', self.ids),
+                                             ('name', 'in', list(names.values()))]):
+            attachments[attachment.res_id] = attachment
+        missing = self.filtered(lambda order: order.id not in attachments)
+        cached = len(attachments)
+        if not missing:
+            return attachments
+
+        args = [(self.env.cr.dbname, self.env.uid, dict(self.env.context), order.id, order.sale_order_id.id)
+                for order in missing]
+        pool = ThreadPool(max(1, min(workers, len(args))))
+        try:
+            for order_id, pdf in pool.imap_unordered(_render_pdf, args):
+                if pdf is None:
+                    continue
+                attachments[order_id] = Attachment.create({
+                    'name': names[order_id],
+                    'datas_fname': names[order_id],
+                    'datas': base64.b64encode(pdf),
+                    'mimetype': 'application/pdf',
+                    'res_model': self._name,
+                    'res_id': order_id,
+                })
+        finally:
+            pool.close()
+            pool.join()
+        # drop the PDFs of previous versions of the rendered orders
+        Attachment.search([('res_model', '=', self._name), ('res_id', 'in', missing.ids),
+                           ('name', '=like', 'quotation-%'),
+                           ('name', 'not in', [names[order_id] for order_id in missing.ids])]).unlink()
+        _logger.info("Installment quotations: %d rendered, %d from cache", len(attachments) - cached, cached)
+        return attachments
+
+
+class InstallmentQuotationPrintJob(models.Model):
+    """
+    Batch printing of installment quotations queued by the print wizard and processed by a cron
+    job: the PDFs are either kept as attachments of the orders or archived in a ZIP file stored
+    as an attachment of the job.
+    """
+    _name = 'installment.quotation.print.job'
+    _description = 'Installment Quotation Printing Job'
+    _order = 'id desc'
+
+    order_ids = fields.Many2many('installment.sale', string='Orders', required=True, readonly=True)
+    output = fields.Selection([('zip', 'ZIP Archive'), ('attachment', 'Attachments on the Orders')],
+                              default='zip', required=True, readonly=True)
+    workers = fields.Integer('Parallel Renderings', default=QUOTATION_WORKERS, required=True, readonly=True)
+    state = fields.Selection([('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+                             string='Status', default='pending', required=True, readonly=True, index=True)
+    archive_id = fields.Many2one('ir.attachment', 'Archive', readonly=True, ondelete='set null')
+    printed_count = fields.Integer('Quotations Printed', readonly=True)
+    failed_count = fields.Integer('Quotations Failed', readonly=True)
+    date_start = fields.Datetime('Started', readonly=True)
+    date_end = fields.Datetime('Finished', readonly=True)
+    duration = fields.Float('Duration (s)', readonly=True)
+    error = fields.Text('Error', readonly=True)
+
+    @api.multi
+    def action_download(self):
+        self.ensure_one()
+        if not self.archive_id:
+            raise UserError(_('There is no archive to download.'))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%d?download=true' % self.archive_id.id,
+            'target': 'self',
+        }
+
+    @api.model
+    def _cron_process_jobs(self):
+        """ Print the pending jobs, oldest first, committing after each one. """
+        cr = self.env.cr
+        for job in self.search([('state', '=', 'pending')], order='id'):
+            try:
+                job._run()
+            except Exception as e:
+                cr.rollback()
+                self.env.clear()
+                _logger.exception("Installment quotation printing job %s failed", job.id)
+                job.write({'state': 'failed', 'error': tools.ustr(e), 'date_end': fields.Datetime.now()})
+            cr.commit()
+        return True
+
+    @api.multi
+    def _run(self):
+        self.ensure_one()
+        cr = self.env.cr
+        start = time.time()
+        orders = self.order_ids
+        orders.filtered(lambda order: order.state == 'draft').write({'state': 'sent'})
+        self.write({'state': 'running', 'date_start': fields.Datetime.now()})
+        # the renderings use cursors of their own and only see committed data
+        cr.commit()
+        attachments = orders._render_quotations(workers=self.workers)
+        vals = {
+            'state': 'done' if attachments else 'failed',
+            'printed_count': len(attachments),
+            'failed_count': len(orders) - len(attachments),
+            'date_end': fields.Datetime.now(),
+        }
+        if not attachments:
+            vals['error'] = _('No quotation could be printed.')
+        elif self.output == 'zip':
+            vals['archive_id'] = self._zip_attachments(orders, attachments).id
+        vals['duration'] = time.time() - start
+        self.write(vals)
+
+    @api.multi
+    def _zip_attachments(self, orders, attachments):
+        """
+        Archive the PDFs in a ZIP file built one PDF at a time in a temporary file, and store it as
+        an attachment of the job.
+        """
+        self.ensure_one()
+        with tempfile.TemporaryFile() as fileobj:
+            with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for order in orders:
+                    attachment = attachments.get(order.id)
+                    if attachment:
+                        archive.writestr('%s.pdf' % order.name.replace('/', '_'), base64.b64decode(attachment.datas))
+                        # the PDFs are not needed in the cache once archived
+                        attachment.invalidate_cache(['datas'], attachment.ids)
+            fileobj.seek(0)
+            name = 'quotations-%d.zip' % self.id
+            return self.env['ir.attachment'].create({
+                'name': name,
+                'datas_fname': name,
+                'datas': base64.b64encode(fileobj.read()),
+                'mimetype': 'application/zip',
+                'res_model': self._name,
+                'res_id': self.id,
+            })
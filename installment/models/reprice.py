@@ -0,0 +1,162 @@
+import logging
+import time
+
+from odoo import api, fields, models, tools, _
+
+from ..instrumentation import instrumented
+
+_logger = logging.getLogger(__name__)
+
+REPRICE_CHUNK_SIZE = 500
+# a failing job is resumed by the next runs of the cron, and given up after this many failures
+REPRICE_MAX_ATTEMPTS = 3
+# fields of the purchase terms and of their category rows used by the installment pricing
+REPRICE_TERM_FIELDS = {'number_of_months', 'spot_adv_discount', 'deferred_adv_discount', 'deferred_adv_count'}
+REPRICE_CATEGORY_FIELDS = {'deferred_revenue_id', 'product_category_id', 'interest_type', 'interest_rate',
+                           'advance_payment_type', 'advance_payment'}
+
+
+class InstallmentRepriceJob(models.Model):
+    """
+    Repricing of the quotations using a purchase term, queued when the term or one of its
+    category rows changes and processed in committed chunks by a cron job. Confirmed contracts
+    keep their price.
+    """
+    _name = 'installment.reprice.job'
+    _description = 'Installment Repricing Job'
+    _order = 'id desc'
+
+    name = fields.Char('Name', compute='_compute_name')
+    deferred_revenue_id = fields.Many2one('deferred.revenue.custom', 'Purchase Term', required=True, readonly=True,
+                                          ondelete='cascade')
+    product_category_id = fields.Many2one('product.category', 'Category', readonly=True, ondelete='cascade',
+                                          help="Only the quotations of this category are repriced; all of them "
+                                               "when empty.")
+    state = fields.Selection([('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+                             string='Status', default='pending', required=True, readonly=True, index=True)
+    order_count = fields.Integer('Quotations to Reprice', readonly=True)
+    done_count = fields.Integer('Quotations Repriced', readonly=True)
+    progress = fields.Float('Progress (%)', compute='_compute_progress')
+    last_order_id = fields.Integer('Last Repriced Order', readonly=True,
+                                   help="Quotations are repriced by increasing id; a restarted job resumes after it.")
+    date_start = fields.Datetime('Started', readonly=True)
+    date_end = fields.Datetime('Finished', readonly=True)
+    attempt_count = fields.Integer('Failed Attempts', readonly=True)
+    error = fields.Text('Error', readonly=True)
+
+    @api.model_cr
+    def init(self):
+        # lookup of the quotations to reprice, by increasing id
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS installment_sale_reprice_index
+                            ON installment_sale (deferred_revenue_id, product_category_id, id)
+                            WHERE state IN ('draft', 'sent')""")
+
+    @api.depends('deferred_revenue_id', 'product_category_id')
+    def _compute_name(self):
+        for job in self:
+            job.name = _('Repricing of %s') % job.deferred_revenue_id.name
+            if job.product_category_id:
+                job.name += ' / %s' % job.product_category_id.name
+
+    @api.depends('order_count', 'done_count')
+    def _compute_progress(self):
+        for job in self:
+            job.progress = 100.0 * job.done_count / job.order_count if job.order_count else 0.0
+
+    @api.model
+    def _enqueue(self, keys):
+        """
+        Queue the repricing of the quotations of ``keys``, a list of ``(term id, category id)``
+        (category ``False`` for all the categories of the term), unless a pending job already
+        covers them.
+        """
+        keys = set((term_id, categ_id or False) for term_id, categ_id in keys if term_id)
+        if not keys:
+            return self.browse()
+        pending = set((job.deferred_revenue_id.id, job.product_category_id.id or False) for job in self.search([
+            ('state', '=', 'pending'), ('deferred_revenue_id', 'in', list(set(key[0] for key in keys)))]))
+        jobs = self.browse()
+        for term_id, categ_id in sorted(keys):
+            if (term_id, False) in pending or (term_id, categ_id) in pending:
+                continue
+            jobs |= self.create({'deferred_revenue_id': term_id, 'product_category_id': categ_id})
+            pending.add((term_id, categ_id))
+        return jobs
+
+    @api.multi
+    def _select_orders(self, limit):
+        self.ensure_one()
+        query = """
+            SELECT id FROM installment_sale
+            WHERE deferred_revenue_id = %s AND state IN ('draft', 'sent') AND id > %s
+        """
+        params = [self.deferred_revenue_id.id, self.last_order_id]
+        if self.product_category_id:
+            query += " AND product_category_id = %s"
+            params.append(self.product_category_id.id)
+        self.env.cr.execute(query + " ORDER BY id LIMIT %s", params + [limit])
+        return self.env['installment.sale'].browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.multi
+    def _count_orders(self):
+        self.ensure_one()
+        domain = [('deferred_revenue_id', '=', self.deferred_revenue_id.id), ('state', 'in', ('draft', 'sent'))]
+        if self.product_category_id:
+            domain.append(('product_category_id', '=', self.product_category_id.id))
+        return self.env['installment.sale'].search_count(domain)
+
+    @api.model
+    def _cron_process_jobs(self, chunk_size=REPRICE_CHUNK_SIZE):
+        """
+        Run the pending and interrupted jobs, oldest first, committing after each chunk. A failing
+        job stays running and resumes after its last committed chunk at the next run, until it
+        has failed ``REPRICE_MAX_ATTEMPTS`` times.
+        """
+        # the repriced amounts are not tracked on the quotations, the job keeps the count
+        self = self.with_context(installment_tracking='off')
+        cr = self.env.cr
+        for job in self.search([('state', 'in', ('pending', 'running'))], order='id'):
+            try:
+                job._run(chunk_size)
+            except Exception as e:
+                cr.rollback()
+                self.env.clear()
+                _logger.exception("Installment repricing job %s failed", job.id)
+                attempt_count = job.attempt_count + 1
+                vals = {'attempt_count': attempt_count, 'error': tools.ustr(e)}
+                if attempt_count >= REPRICE_MAX_ATTEMPTS:
+                    vals.update(state='failed', date_end=fields.Datetime.now())
+                job.write(vals)
+                cr.commit()
+        return True
+
+    @api.multi
+    def action_retry(self):
+        """ Resume failed jobs after their last committed chunk. """
+        self.filtered(lambda job: job.state == 'failed').write({'state': 'running', 'attempt_count': 0,
+                                                                'date_end': False})
+        return True
+
+    @api.multi
+    @instrumented
+    def _run(self, chunk_size=REPRICE_CHUNK_SIZE):
+        self.ensure_one()
+        cr = self.env.cr
+        if self.state == 'pending':
+            self.write({'state': 'running', 'date_start': fields.Datetime.now(), 'order_count': self._count_orders()})
+            cr.commit()
+        start = time.time()
+        while True:
+            orders = self._select_orders(chunk_size)
+            if not orders:
+                break
+            # the amounts depend on the purchase term: recompute them as for a change of term
+            orders.modified(['deferred_revenue_id'])
+            orders.recompute()
+            self.write({'done_count': self.done_count + len(orders), 'last_order_id': orders[-1].id})
+            cr.commit()
+            self.env.invalidate_all()
+        self.write({'state': 'done', 'date_end': fields.Datetime.now()})
+        cr.commit()
+        _logger.info("Installment repricing job %s: %d quotations repriced in %.2fs", self.id, self.done_count,
+                     time.time() - start)
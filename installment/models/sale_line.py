@@ -15,16 +15,27 @@ class InstallmentSaleLine(models.Model):
     #                                        ondelete='cascade', index=True,
     #                                        copy=False)
     installment_price_subtotal = fields.Monetary(string='Subtotal', readonly=True, store=True)
-    installment_price_tax = fields.Monetary(string='Taxes', readonly=True, store=True)
-    installment_price_total = fields.Monetary(string='Total', readonly=True, store=True)
+    installment_price_tax = fields.Monetary(string='Taxes', readonly=True, store=True,
+                                            compute='_compute_installment_amount')
+    installment_price_total = fields.Monetary(string='Total', readonly=True, store=True,
+                                              compute='_compute_installment_amount')
 
-    @api.depends('product_uom_qty', 'discount', 'price_unit', 'tax_id')
+    @api.depends('installment_price_subtotal', 'tax_id')
     def _compute_installment_amount(self):
+        """
+        Compute the taxes of the installment subtotals set by the orders. Lines with the same
+        taxes, subtotal, product and delivery address share a single tax computation.
+        """
+        computed = {}
         for line in self:
-
+            partner = line.order_id.partner_shipping_id
+            key = (tuple(line.tax_id.ids), line.installment_price_subtotal, line.currency_id.id, line.product_id.id,
+                   partner.id)
+            if key not in computed:
+                computed[key] = line.tax_id.compute_all(line.installment_price_subtotal, line.currency_id, 1.0,
+                                                        product=line.product_id, partner=partner)
+            taxes = computed[key]
             line.update({
-                'installment_price_tax': '',
-                'installment_price_total': '',
+                'installment_price_tax': taxes['total_included'] - taxes['total_excluded'],
+                'installment_price_total': taxes['total_included'],
             })
-
-
@@ -1,39 +1,111 @@
+import logging
+import time
 from itertools import groupby
 from datetime import datetime, timedelta
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
-from odoo.tools import float_is_zero, float_compare, DEFAULT_SERVER_DATETIME_FORMAT
+from odoo.tools import float_is_zero, float_compare, split_every, DEFAULT_SERVER_DATETIME_FORMAT
+from odoo.tools.lru import LRU
 from odoo.tools.misc import formatLang
 
 import odoo.addons.decimal_precision as dp
 
+from .. import pricing
+from ..instrumentation import instrumented
+
+_logger = logging.getLogger(__name__)
+
+PRICING_ARGS = ['unit_price', 'advance_payment_type', 'advance_payment', 'interest_type', 'interest_rate',
+                'number_of_months', 'spot_adv_discount', 'deferred_adv_discount', 'deferred_adv_count']
+
+# per-worker cache of the values resolved by the partner onchange: {key: (expiry time, values)}
+PARTNER_CACHE_TTL = 60
+_partner_cache = LRU(4096)
+
+# cursor cache key of the initial values buffered in 'summary' tracking mode
+TRACKING_BUFFER_KEY = 'installment_tracking_buffer'
+
 
 class InstallmentSales(models.Model):
     _name = 'installment.sale'
+    _inherit = ['mail.thread']
     _inherits = {'sale.order': 'sale_order_id'}
+    _order = 'date_order desc, id desc'
 
     sale_order_id = fields.Many2one(
         'sale.order', 'Installment Sale Reference',
         auto_join=True, index=True, ondelete="cascade", required=True)
 
+    @api.multi
+    @instrumented
+    def _resolve_invoices(self):
+        """
+        Return ``{order_id: (invoice_ids, refund_ids)}`` for the orders of ``self``, in a fixed
+        number of queries whatever the number of orders:
+        - invoices reached through the invoice lines of the order lines,
+        - customer invoices/refunds whose origin mentions the order,
+        - refunds whose origin is the number of one of those invoices, in the same journal.
+        """
+        cr = self.env.cr
+        res = dict((order.id, (set(), set())) for order in self)
+        if not self:
+            return res
+        line_order = {}
+        for order in self:
+            for line_id in order.order_line.ids:
+                line_order[line_id] = order.id
+        if line_order:
+            cr.execute("""
+                SELECT DISTINCT rel.order_line_id, inv.id
+                FROM sale_order_line_invoice_rel rel
+                JOIN account_invoice_line line ON line.id = rel.invoice_line_id
+                JOIN account_invoice inv ON inv.id = line.invoice_id
+                WHERE rel.order_line_id IN %s AND inv.type IN ('out_invoice', 'out_refund')
+            """, (tuple(line_order),))
+            for line_id, invoice_id in cr.fetchall():
+                res[line_order[line_id]][0].add(invoice_id)
+
+        orders = [(order.id, order.name, order.company_id.id) for order in self if order.name]
+        if orders:
+            # origins are comma-separated lists of references: they are split into exact tokens,
+            # hash-joined with the order names
+            cr.execute("""
+                SELECT o.id, origin.invoice_id
+                FROM (SELECT inv.id AS invoice_id, inv.company_id,
+                             btrim(unnest(string_to_array(inv.origin, ','))) AS name
+                      FROM account_invoice inv
+                      WHERE inv.type IN ('out_invoice', 'out_refund') AND inv.origin IS NOT NULL) origin
+                JOIN (SELECT unnest(%s::int[]) AS id, unnest(%s::varchar[]) AS name,
+                             unnest(%s::int[]) AS company_id) o
+                  ON o.name = origin.name AND o.company_id = origin.company_id
+            """, ([o[0] for o in orders], [o[1] for o in orders], [o[2] for o in orders]))
+            for order_id, invoice_id in cr.fetchall():
+                res[order_id][0].add(invoice_id)
+
+        invoice_orders = {}
+        for order_id, (invoice_ids, refund_ids) in res.items():
+            for invoice_id in invoice_ids:
+                invoice_orders.setdefault(invoice_id, []).append(order_id)
+        if invoice_orders:
+            cr.execute("""
+                SELECT inv.id, refund.id
+                FROM account_invoice inv
+                JOIN account_invoice refund
+                  ON refund.origin = inv.number AND refund.journal_id = inv.journal_id
+                 AND refund.type = 'out_refund'
+                WHERE inv.id IN %s AND inv.number IS NOT NULL
+            """, (tuple(invoice_orders),))
+            for invoice_id, refund_id in cr.fetchall():
+                for order_id in invoice_orders[invoice_id]:
+                    res[order_id][1].add(refund_id)
+        return res
+
     @api.depends('state', 'order_line.invoice_status')
+    @instrumented
     def _get_invoiced(self):
+        deposit_product_id = self.env['sale.advance.payment.inv']._default_product_id()
         for order in self:
-            invoice_ids = order.order_line.mapped('invoice_lines').mapped('invoice_id').filtered(
-                lambda r: r.type in ['out_invoice', 'out_refund'])
-            refunds = invoice_ids.search(
-                [('origin', 'like', order.name), ('company_id', '=', order.company_id.id)]).filtered(
-                lambda r: r.type in ['out_invoice', 'out_refund'])
-            invoice_ids |= refunds.filtered(lambda r: order.name in [origin.strip() for origin in r.origin.split(',')])
-            refund_ids = self.env['account.invoice'].browse()
-            if invoice_ids:
-                for inv in invoice_ids:
-                    refund_ids += refund_ids.search(
-                        [('type', '=', 'out_refund'), ('origin', '=', inv.number), ('origin', '!=', False),
-                         ('journal_id', '=', inv.journal_id.id)])
-
-            deposit_product_id = self.env['sale.advance.payment.inv']._default_product_id()
             line_invoice_status = [line.invoice_status for line in order.order_line if
                                    line.product_id != deposit_product_id]
 
@@ -47,12 +119,72 @@ class InstallmentSales(models.Model):
                 invoice_status = 'upselling'
             else:
                 invoice_status = 'no'
+            order.invoice_status = invoice_status
 
-            order.update({
-                'invoice_count': len(set(invoice_ids.ids + refund_ids.ids)),
-                'invoice_ids': invoice_ids.ids + refund_ids.ids,
-                'invoice_status': invoice_status
-            })
+    @api.model
+    def _link_invoices(self, order_invoices):
+        """
+        Add invoices to the stored invoice linkage of orders and refresh their invoice count.
+
+        :param order_invoices: ``{order_id: invoice_ids}``
+        """
+        rows = [(order_id, invoice_id) for order_id, invoice_ids in order_invoices.items() for invoice_id in invoice_ids]
+        if not rows:
+            return
+        cr = self.env.cr
+        for chunk in split_every(1000, rows):
+            cr.execute("""INSERT INTO installment_sale_account_invoice_rel (order_id, invoice_id)
+                          VALUES %s ON CONFLICT DO NOTHING""" % ', '.join(['(%s, %s)'] * len(chunk)),
+                       [value for row in chunk for value in row])
+        self._update_invoice_count(list(order_invoices))
+
+    @api.model
+    def _update_invoice_count(self, order_ids):
+        if not order_ids:
+            return
+        self.env.cr.execute("""
+            UPDATE installment_sale sale
+            SET invoice_count = (SELECT count(*) FROM installment_sale_account_invoice_rel rel
+                                 WHERE rel.order_id = sale.id)
+            WHERE sale.id IN %s
+        """, (tuple(order_ids),))
+        self.invalidate_cache(['invoice_ids', 'invoice_count'], list(order_ids))
+
+    @api.multi
+    def action_sync_invoices(self):
+        """ Link the invoices resolved from order lines and origins (e.g. refunds made by hand). """
+        for ids in split_every(1000, self.ids):
+            resolved = self.browse(ids)._resolve_invoices()
+            self._link_invoices(dict(
+                (order_id, invoice_ids | refund_ids) for order_id, (invoice_ids, refund_ids) in resolved.items()))
+            self.invalidate_cache()
+        return True
+
+    @api.model_cr_context
+    def _auto_init(self):
+        self._cr.execute("SELECT 1 FROM pg_class WHERE relname = 'installment_sale_account_invoice_rel'")
+        new_linkage = not self._cr.fetchone()
+        res = super(InstallmentSales, self)._auto_init()
+        if new_linkage:
+            # populate the stored invoice linkage of the orders created before it existed, once
+            self._cr.execute("SELECT id FROM installment_sale WHERE state IN ('sale', 'done', 'cancel')")
+            order_ids = [row[0] for row in self._cr.fetchall()]
+            if order_ids:
+                _logger.info("Linking the invoices of %d existing installment orders", len(order_ids))
+                self.browse(order_ids).action_sync_invoices()
+        return res
+
+    @api.model_cr
+    def init(self):
+        # composite indexes of the default filters and sort order of the list view
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS installment_sale_date_order_id_index
+                            ON installment_sale (date_order DESC, id DESC)""")
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS installment_sale_state_date_order_index
+                            ON installment_sale (state, date_order DESC, id DESC)""")
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS installment_sale_partner_date_order_index
+                            ON installment_sale (order_partner_id, date_order DESC, id DESC)""")
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS installment_sale_user_state_date_order_index
+                            ON installment_sale (user_id, state, date_order DESC, id DESC)""")
 
     @api.model
     def _default_note(self):
@@ -96,6 +228,11 @@ class InstallmentSales(models.Model):
                                         copy=False)
     user_id = fields.Many2one('res.users', string='Salesperson', index=True, track_visibility='onchange',
                               default=lambda self: self.env.user)
+    confirmation_email_pending = fields.Boolean('Confirmation Email Pending', readonly=True, copy=False,
+                                                index=True)
+    # stored copy of the delegated customer, to filter and sort the list without joining sale_order
+    order_partner_id = fields.Many2one('res.partner', related='sale_order_id.partner_id', string='Customer',
+                                       store=True, readonly=True)
 
     partner_invoice_id = fields.Many2one('res.partner', string='Invoice Address', readonly=True, required=True,
                                          states={'draft': [('readonly', False)], 'sent': [('readonly', False)]},
@@ -119,9 +256,9 @@ class InstallmentSales(models.Model):
     order_line = fields.One2many('sale.order.line', 'order_id', string='Order Lines',
                                  states={'cancel': [('readonly', True)], 'done': [('readonly', True)]}, copy=True, limit=1)
 
-    invoice_count = fields.Integer(string='# of Invoices', compute='_get_invoiced', readonly=True)
-    invoice_ids = fields.Many2many("account.invoice", string='Invoices', compute="_get_invoiced", readonly=True,
-                                   copy=False)
+    invoice_count = fields.Integer(string='# of Invoices', readonly=True, copy=False)
+    invoice_ids = fields.Many2many("account.invoice", 'installment_sale_account_invoice_rel', 'order_id', 'invoice_id',
+                                   string='Invoices', readonly=True, copy=False)
     invoice_status = fields.Selection([
         ('upselling', 'Upselling Opportunity'),
         ('invoiced', 'Fully Invoiced'),
@@ -146,13 +283,11 @@ class InstallmentSales(models.Model):
 
     @api.multi
     @api.onchange('product_category_id', 'purchase_type')
+    @instrumented
     def _revenue_domain(self):
-        ids = []
-        for order in self:
-            revenue_category = order.env['deferred.revenue.category'].search([('product_category_id', '=', order.product_category_id.id)])
-        for rev in revenue_category:
-            ids.append(rev.id)
-        domain = [('covered_category_ids', 'in', ids), ('purchase_type', '=', self.purchase_type)]
+        ids = list(self.env['deferred.revenue.custom']._get_eligible_terms(self.product_category_id.id,
+                                                                            self.purchase_type))
+        domain = [('id', 'in', ids)]
         if self.product_category_id:
             self.deferred_revenue_id = False if not ids else ids[0]
         return {
@@ -185,49 +320,167 @@ class InstallmentSales(models.Model):
                                  track_visibility='always')
 
     @api.multi
+    @instrumented
     def _compute_order_line(self):
-        price_subtotal = 0.0
+        """
+        Set the contract total of the orders as the installment subtotal of their lines. Only the
+        lines whose subtotal changes are written, all in one statement; the lines of new records
+        (onchanges) are only updated in cache.
+        """
+        terms = self.env['deferred.revenue.custom']._get_term_table()['terms']
+        changed = []
         for order in self:
-            if order.is_spot_advance:
-                price_subtotal = order.spot_advance + (
-                        order.monthly_amortization * order.deferred_revenue_id.number_of_months)
-            elif order.is_deferred_advance:
-                price_subtotal = (order.deferred_advance * order.deferred_revenue_id.deferred_adv_count) + (
-                            order.monthly_amortization * order.deferred_revenue_id.number_of_months)
+            term = terms.get(order.deferred_revenue_id.id, {})
+            price_subtotal = pricing.contract_total(
+                order._get_advance_choice(), order.spot_advance, order.deferred_advance,
+                term.get('deferred_adv_count', 0), order.monthly_amortization, term.get('number_of_months', 0))
             for line in order.order_line:
-                line.update({
-                    'installment_price_subtotal': price_subtotal,
-                })
+                if not line.id:
+                    line.installment_price_subtotal = price_subtotal
+                elif float_compare(line.installment_price_subtotal, price_subtotal,
+                                   precision_rounding=order.currency_id.rounding or 0.01):
+                    changed.append((line.id, price_subtotal))
+        if changed:
+            self.env.cr.execute("""
+                UPDATE sale_order_line sol
+                SET installment_price_subtotal = v.subtotal, write_uid = %%s, write_date = (now() at time zone 'UTC')
+                FROM (VALUES %s) AS v(id, subtotal)
+                WHERE sol.id = v.id
+            """ % ', '.join(['(%s, %s::numeric)'] * len(changed)),
+                [self.env.uid] + [value for row in changed for value in row])
+            lines = self.env['sale.order.line'].browse([line_id for line_id, price_subtotal in changed])
+            lines.invalidate_cache(['installment_price_subtotal'])
+            # the taxes and totals of the lines are recomputed with the pending recomputations
+            lines.modified(['installment_price_subtotal'])
 
+    @api.multi
+    def _get_advance_choice(self):
+        self.ensure_one()
+        if self.is_spot_advance:
+            return 'spot'
+        elif self.is_deferred_advance:
+            return 'deferred'
+        return False
 
-    @api.depends('product_category_id', 'purchase_type', 'deferred_revenue_id', 'order_line', 'is_spot_advance', 'is_deferred_advance')
-    def _compute_installment_amount(self):
-        for order in self:
-            company_id = order.env.user.company_id
-            categ = self.env['deferred.revenue.category'].search([('product_category_id', '=', order.product_category_id.id), ('deferred_revenue_id', '=', order.deferred_revenue_id.id)])
-            advance = 0.0
-            unit_price = sum(line.price_unit for line in order.order_line)
-            if categ.advance_payment_type == 'perc':
-                advance = unit_price * (categ.advance_payment / 100)
-            elif categ.advance_payment_type == 'fix':
-                advance = categ.advance_payment
-            else:
-                advance = 0.0
-            balance = unit_price - advance
-            balance_with_interest = float(balance) * (1 + categ.interest_rate / 100)
+    @api.model
+    def _price_installments(self, items):
+        """
+        Price a batch of contracts with the purchase term rules of the cached term table.
 
-            monthly_amortization = 0.0 if not order.deferred_revenue_id else balance_with_interest / int(order.deferred_revenue_id.number_of_months)
-            # print amort if (amort % 1 == 0) else round(amort + 0.5)
-            deferred_adv = 0.0 if not advance else advance * (1 - order.deferred_revenue_id.deferred_adv_discount / 100)
-            def_val = deferred_adv / (1 if not order.deferred_revenue_id.deferred_adv_count else int(order.deferred_revenue_id.deferred_adv_count))
+        :param items: iterable of ``(unit_price, product_category_id, deferred_revenue_id)``
+        :returns: the dict of lists returned by :func:`~odoo.addons.installment.pricing.compute_installments`
+        """
+        table = self.env['deferred.revenue.custom']._get_term_table()
+        args = dict((key, []) for key in PRICING_ARGS)
+        for unit_price, categ_id, term_id in items:
+            term = table['terms'].get(term_id, {})
+            categ = table['categories'].get((categ_id, term_id), {})
+            args['unit_price'].append(unit_price)
+            args['advance_payment_type'].append(categ.get('advance_payment_type') or 'none')
+            args['advance_payment'].append(categ.get('advance_payment', 0.0))
+            args['interest_type'].append(categ.get('interest_type') or 'simple')
+            args['interest_rate'].append(categ.get('interest_rate', 0.0))
+            args['number_of_months'].append(term.get('number_of_months', 0))
+            args['spot_adv_discount'].append(term.get('spot_adv_discount', 0.0))
+            args['deferred_adv_discount'].append(term.get('deferred_adv_discount', 0.0))
+            args['deferred_adv_count'].append(term.get('deferred_adv_count', 0))
+        return pricing.compute_installments(**args)
 
+    @api.model
+    @instrumented
+    def simulate_quotes(self, items):
+        """
+        Price quotes without creating any record, with the same rules as the installment amount
+        compute. Each item is a dict with:
+        - ``product_id`` or ``product_category_id``: the category is the root category of the product
+        - ``price_unit``: defaults to the sale price of the product
+        - ``deferred_revenue_id``: the purchase term
+        - ``advance``: ``'spot'``, ``'deferred'`` or nothing
+
+        :returns: one dict per item with the computed amounts, or with an ``error`` message when
+                  the item is invalid (not a dict, ids or price that are not numbers...)
+        """
+        res = [None] * len(items)
+        parsed = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                res[index] = {'error': _('Invalid quote request %r') % (item,)}
+                continue
+            try:
+                parsed[index] = {
+                    'product_id': int(item['product_id']) if item.get('product_id') else None,
+                    'product_category_id': (int(item['product_category_id'])
+                                            if item.get('product_category_id') else None),
+                    'price_unit': float(item['price_unit']) if item.get('price_unit') is not None else None,
+                    'deferred_revenue_id': int(item['deferred_revenue_id']) if item.get('deferred_revenue_id') else None,
+                }
+            except (TypeError, ValueError):
+                res[index] = {'error': _('Invalid values in quote request %r') % (item,)}
+
+        products = self.env['product.product'].browse(
+            set(values['product_id'] for values in parsed.values() if values['product_id']))
+        product_categ = {}
+        for product in products.exists():
+            categ = product.categ_id
+            while categ.parent_id:
+                categ = categ.parent_id
+            product_categ[product.id] = (categ.id, product.lst_price)
+
+        terms = self.env['deferred.revenue.custom']._get_term_table()['terms']
+        currency = self.env.user.company_id.currency_id
+        valid = []
+        for index in sorted(parsed):
+            values = parsed[index]
+            categ_id = values['product_category_id']
+            price_unit = values['price_unit']
+            if values['product_id']:
+                if values['product_id'] not in product_categ:
+                    res[index] = {'error': _('Unknown product %s') % values['product_id']}
+                    continue
+                categ_id, list_price = product_categ[values['product_id']]
+                if price_unit is None:
+                    price_unit = list_price
+            if not categ_id or price_unit is None:
+                res[index] = {'error': _('A product or a category and a price are required.')}
+                continue
+            if values['deferred_revenue_id'] not in terms:
+                res[index] = {'error': _('Unknown purchase term %s') % values['deferred_revenue_id']}
+                continue
+            valid.append((index, (price_unit, categ_id, values['deferred_revenue_id'])))
+
+        prices = self._price_installments([values for index, values in valid])
+        for position, (index, (price_unit, categ_id, term_id)) in enumerate(valid):
+            term = terms[term_id]
+            quote = dict((key, currency.round(prices[key][position])) for key in pricing.RESULT_KEYS)
+            quote['number_of_months'] = term['number_of_months']
+            quote['total'] = currency.round(pricing.contract_total(
+                items[index].get('advance'), prices['spot_advance'][position], prices['deferred_advance'][position],
+                term['deferred_adv_count'], prices['monthly_amortization'][position], term['number_of_months']))
+            res[index] = quote
+        return res
+
+    @api.depends('product_category_id', 'deferred_revenue_id', 'order_line.price_unit', 'is_spot_advance',
+                 'is_deferred_advance')
+    @instrumented
+    def _compute_installment_amount(self):
+        """
+        Price the orders from the sum of their line prices and their purchase term. Only the
+        fields used by the pricing are dependencies: editing anything else on a line (its
+        description, quantity...) does not reprice the order, and changes of the purchase terms
+        themselves reprice the open quotations through their own job.
+        """
+        prices = self._price_installments(
+            (sum(line.price_unit for line in order.order_line), order.product_category_id.id,
+             order.deferred_revenue_id.id) for order in self)
+        for index, order in enumerate(self):
             order.update({
-                'advance_payment': advance,
-                'spot_advance': 0.0 if not advance else advance * (1 - order.deferred_revenue_id.spot_adv_discount / 100),
-                'deferred_advance': def_val,
-                'monthly_amortization': monthly_amortization,
+                'advance_payment': prices['advance'][index],
+                'spot_advance': prices['spot_advance'][index],
+                'deferred_advance': prices['deferred_advance'][index],
+                'balance': prices['balance'][index],
+                'monthly_amortization': prices['monthly_amortization'][index],
             })
-            order._compute_order_line()
+        self._compute_order_line()
 
     @api.onchange('is_spot_advance')
     def _onchange_is_spot_advance(self):
@@ -277,81 +530,182 @@ class InstallmentSales(models.Model):
             return 'sale.mt_order_sent'
         return super(InstallmentSales, self)._track_subtype(init_values)
 
+    @api.model
+    def _tracking_mode(self):
+        """
+        Return how changes of orders are tracked, from the ``installment_tracking`` context key:
+
+        - ``full`` (default): every write posts its own tracking message, for interactive edits;
+        - ``summary``: the changes are buffered for the transaction and posted as one message per
+          order by :meth:`_flush_tracking`, for bulk recomputations;
+        - ``off``: nothing is tracked, for bulk jobs that keep their own log.
+        """
+        return self.env.context.get('installment_tracking') or 'full'
+
+    @api.model
+    def create(self, vals):
+        if self._tracking_mode() == 'off':
+            return super(InstallmentSales, self.with_context(tracking_disable=True)).create(vals).with_env(self.env)
+        return super(InstallmentSales, self).create(vals)
+
     @api.multi
-    @api.onchange('partner_shipping_id', 'partner_id')
-    def onchange_partner_shipping_id(self):
+    def write(self, vals):
+        if self._tracking_mode() == 'off':
+            return super(InstallmentSales, self.with_context(tracking_disable=True)).write(vals)
+        return super(InstallmentSales, self).write(vals)
+
+    @api.multi
+    def message_track(self, tracked_fields, initial_values):
+        if self._tracking_mode() != 'summary':
+            return super(InstallmentSales, self).message_track(tracked_fields, initial_values)
+        buffer = self.env.cr.cache.setdefault(TRACKING_BUFFER_KEY, {})
+        for order_id, values in initial_values.items():
+            # only the values before the first change of the transaction are kept
+            pending = buffer.setdefault(order_id, {})
+            for name, value in values.items():
+                pending.setdefault(name, value)
+        return True
+
+    @api.model
+    def _flush_tracking(self):
         """
-        Trigger the change of fiscal position when the shipping address is modified.
+        Post the changes buffered in ``summary`` tracking mode, one message per changed order
+        with the tracking values from the first buffered values to the current ones. Bulk jobs
+        call it before committing, and :meth:`_discard_tracking` after rolling back.
         """
-        self.fiscal_position_id = self.env['account.fiscal.position'].get_fiscal_position(self.partner_id.id,
-                                                                                          self.partner_shipping_id.id)
-        return {}
+        buffer = self.env.cr.cache.pop(TRACKING_BUFFER_KEY, None)
+        if not buffer:
+            return 0
+        orders = self.with_context(lang=None, installment_tracking='full').browse(list(buffer)).exists()
+        tracked_fields = orders._get_tracked_fields([])
+        posted = 0
+        for order in orders:
+            initial = buffer[order.id]
+            changes, tracking_value_ids = order._message_track(
+                dict((name, info) for name, info in tracked_fields.items() if name in initial), initial)
+            if not changes:
+                continue
+            subtype = order._track_subtype(dict((name, initial[name]) for name in changes))
+            order.message_post(subtype=subtype or None, tracking_value_ids=tracking_value_ids)
+            posted += 1
+        _logger.info("Posted the summary tracking of %d installment orders", posted)
+        return posted
+
+    @api.model
+    def _discard_tracking(self):
+        """ Drop the changes buffered in ``summary`` tracking mode, which a rollback has undone. """
+        self.env.cr.cache.pop(TRACKING_BUFFER_KEY, None)
+
+    @api.model
+    def _get_partner_onchange_values(self, partner):
+        """
+        Return the values the customer ``partner`` sets on an order (addresses, pricelist,
+        payment term, salesperson, team, note) and its sale warning as ``(title, message,
+        blocking)`` under the ``warning`` key. Results are cached per worker for
+        ``PARTNER_CACHE_TTL`` seconds, keyed on the partner and its ``write_date``; the returned
+        dict is shared and must not be modified.
+        """
+        key = (self.env.cr.dbname, partner.id, partner.write_date, self.env.user.company_id.id, self.env.uid)
+        entry = _partner_cache.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        addr = partner.address_get(['delivery', 'invoice'])
+        values = {
+            'pricelist_id': partner.property_product_pricelist.id,
+            'payment_term_id': partner.property_payment_term_id.id,
+            'partner_invoice_id': addr['invoice'],
+            'partner_shipping_id': addr['delivery'],
+            'user_id': partner.user_id.id,
+            'team_id': partner.team_id.id,
+            'note': self.with_context(lang=partner.lang).env.user.company_id.sale_note,
+            'warning': None,
+        }
+        # If partner has no warning, check its company
+        warn_partner = partner
+        if warn_partner.sale_warn == 'no-message' and warn_partner.parent_id:
+            warn_partner = warn_partner.parent_id
+        if warn_partner.sale_warn != 'no-message':
+            # Block if partner only has warning but parent company is blocked
+            if warn_partner.sale_warn != 'block' and warn_partner.parent_id and \
+                    warn_partner.parent_id.sale_warn == 'block':
+                warn_partner = warn_partner.parent_id
+            values['warning'] = (_("Warning for %s") % warn_partner.name, warn_partner.sale_warn_msg,
+                                 warn_partner.sale_warn == 'block')
+        _partner_cache[key] = (time.time() + PARTNER_CACHE_TTL, values)
+        return values
+
+    @api.model
+    def _get_cached_fiscal_position(self, partner_id, shipping_id):
+        """ Return the fiscal position id of a customer and delivery address, cached like the partner values. """
+        key = (self.env.cr.dbname, 'fiscal_position', partner_id, shipping_id, self.env.user.company_id.id)
+        entry = _partner_cache.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        fiscal_position_id = self.env['account.fiscal.position'].get_fiscal_position(partner_id, shipping_id)
+        _partner_cache[key] = (time.time() + PARTNER_CACHE_TTL, fiscal_position_id)
+        return fiscal_position_id
+
+    @api.multi
+    def _set_fiscal_position(self, fiscal_position_id):
+        # only an actual change triggers the recomputation of the taxes of the lines
+        if self.fiscal_position_id.id != (fiscal_position_id or False):
+            self.fiscal_position_id = fiscal_position_id
 
     @api.multi
     @api.onchange('partner_id')
+    @instrumented
     def onchange_partner_id(self):
         """
-        Update the following fields when the partner is changed:
+        Update the following fields when the partner is changed, and warn about the partner:
         - Pricelist
         - Payment term
         - Invoice address
         - Delivery address
+        - Salesperson and sales team
+        - Fiscal position
         """
         if not self.partner_id:
             self.update({
                 'partner_invoice_id': False,
                 'partner_shipping_id': False,
                 'payment_term_id': False,
-                'fiscal_position_id': False,
             })
+            self._set_fiscal_position(False)
             return
 
-        addr = self.partner_id.address_get(['delivery', 'invoice'])
+        cached = self._get_partner_onchange_values(self.partner_id)
+        if cached['warning'] and cached['warning'][2]:
+            self.update({'partner_id': False, 'partner_invoice_id': False, 'partner_shipping_id': False,
+                         'pricelist_id': False})
+            return {'warning': {'title': cached['warning'][0], 'message': cached['warning'][1]}}
+
         values = {
-            'pricelist_id': self.partner_id.property_product_pricelist and self.partner_id.property_product_pricelist.id or False,
-            'payment_term_id': self.partner_id.property_payment_term_id and self.partner_id.property_payment_term_id.id or False,
-            'partner_invoice_id': addr['invoice'],
-            'partner_shipping_id': addr['delivery'],
+            'pricelist_id': cached['pricelist_id'],
+            'payment_term_id': cached['payment_term_id'],
+            'partner_invoice_id': cached['partner_invoice_id'],
+            'partner_shipping_id': cached['partner_shipping_id'],
         }
-        if self.env.user.company_id.sale_note:
-            values['note'] = self.with_context(lang=self.partner_id.lang).env.user.company_id.sale_note
-
-        if self.partner_id.user_id:
-            values['user_id'] = self.partner_id.user_id.id
-        if self.partner_id.team_id:
-            values['team_id'] = self.partner_id.team_id.id
+        if cached['note']:
+            values['note'] = cached['note']
+        if cached['user_id']:
+            values['user_id'] = cached['user_id']
+        if cached['team_id']:
+            values['team_id'] = cached['team_id']
         self.update(values)
+        self._set_fiscal_position(self._get_cached_fiscal_position(self.partner_id.id, values['partner_shipping_id']))
 
-    @api.onchange('partner_id')
-    def onchange_partner_id_warning(self):
-        if not self.partner_id:
-            return
-        warning = {}
-        title = False
-        message = False
-        partner = self.partner_id
-
-        # If partner has no warning, check its company
-        if partner.sale_warn == 'no-message' and partner.parent_id:
-            partner = partner.parent_id
+        if cached['warning']:
+            return {'warning': {'title': cached['warning'][0], 'message': cached['warning'][1]}}
 
-        if partner.sale_warn != 'no-message':
-            # Block if partner only has warning but parent company is blocked
-            if partner.sale_warn != 'block' and partner.parent_id and partner.parent_id.sale_warn == 'block':
-                partner = partner.parent_id
-            title = ("Warning for %s") % partner.name
-            message = partner.sale_warn_msg
-            warning = {
-                'title': title,
-                'message': message,
-            }
-            if partner.sale_warn == 'block':
-                self.update({'partner_id': False, 'partner_invoice_id': False, 'partner_shipping_id': False,
-                             'pricelist_id': False})
-                return {'warning': warning}
-
-        if warning:
-            return {'warning': warning}
+    @api.multi
+    @api.onchange('partner_shipping_id')
+    @instrumented
+    def onchange_partner_shipping_id(self):
+        """
+        Trigger the change of fiscal position when the shipping address is modified.
+        """
+        self._set_fiscal_position(self._get_cached_fiscal_position(self.partner_id.id, self.partner_shipping_id.id))
+        return {}
 
     # @api.model
     # def create(self, vals):
@@ -405,7 +759,8 @@ class InstallmentSales(models.Model):
     @api.multi
     def print_quotation(self):
         self.filtered(lambda s: s.state == 'draft').write({'state': 'sent'})
-        return self.env['report'].get_action(self, 'sale.report_saleorder')
+        # the report is defined on the delegated sale orders
+        return self.env['report'].get_action(self.mapped('sale_order_id'), 'sale.report_saleorder')
 
     @api.multi
     def action_view_invoice(self):
@@ -421,6 +776,7 @@ class InstallmentSales(models.Model):
         return action
 
     @api.multi
+    @instrumented
     def action_invoice_create(self, grouped=False, final=False):
         """
         Create the invoice associated to the SO.
@@ -429,6 +785,8 @@ class InstallmentSales(models.Model):
         :param final: if True, refunds will be generated if necessary
         :returns: list of created invoices
         """
+        if self.env.context.get('installment_bulk_invoice'):
+            return self.action_invoice_create_bulk(grouped=grouped, final=final)
         inv_obj = self.env['account.invoice']
         precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
         invoices = {}
@@ -487,8 +845,122 @@ class InstallmentSales(models.Model):
             invoice.message_post_with_view('mail.message_origin_link',
                                            values={'self': invoice, 'origin': references[invoice]},
                                            subtype_id=self.env.ref('mail.mt_note').id)
+        order_invoices = {}
+        for invoice, orders in references.items():
+            for order in orders:
+                order_invoices.setdefault(order.id, set()).add(invoice.id)
+        self._link_invoices(order_invoices)
         return [inv.id for inv in invoices.values()]
 
+    @api.multi
+    def _prepare_bulk_invoices(self, grouped=False, final=False):
+        """
+        Build the values of the invoices of the orders, lines included, without creating anything.
+        Negative invoices are turned into refunds here, so they never need to be rewritten.
+
+        :returns: list of ``(invoice values, orders)``
+        """
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        groups = {}
+        keys = []
+        for order in self:
+            group_key = order.id if grouped else (order.partner_invoice_id.id, order.currency_id.id)
+            for line in order.order_line.sorted(key=lambda l: l.qty_to_invoice < 0):
+                qty = line.qty_to_invoice
+                if float_is_zero(qty, precision_digits=precision) or (qty < 0 and not final):
+                    continue
+                if group_key not in groups:
+                    groups[group_key] = {'vals': order._prepare_invoice(), 'orders': order, 'lines': [],
+                                         'origin': [order.name], 'name': [order.client_order_ref or '']}
+                    keys.append(group_key)
+                group = groups[group_key]
+                if order not in group['orders']:
+                    group['orders'] |= order
+                    group['origin'].append(order.name)
+                    if order.client_order_ref and order.client_order_ref not in group['name']:
+                        group['name'].append(order.client_order_ref)
+                line_vals = line._prepare_invoice_line(qty=qty)
+                line_vals['sale_line_ids'] = [(6, 0, [line.id])]
+                group['lines'].append(line_vals)
+        res = []
+        for group_key in keys:
+            group = groups[group_key]
+            vals = dict(group['vals'], name=', '.join(group['name']), origin=', '.join(group['origin']))
+            amount = sum(l['quantity'] * l['price_unit'] * (1 - (l.get('discount') or 0.0) / 100.0)
+                         for l in group['lines'])
+            if amount < 0:
+                vals['type'] = 'out_refund'
+                for line_vals in group['lines']:
+                    line_vals['quantity'] = -line_vals['quantity']
+            vals['invoice_line_ids'] = [(0, 0, line_vals) for line_vals in group['lines']]
+            res.append((vals, group['orders']))
+        return res
+
+    @api.multi
+    @instrumented
+    def action_invoice_create_bulk(self, grouped=False, final=False, chunk_size=500, post_messages=True,
+                                   commit=False):
+        """
+        High-volume variant of :meth:`action_invoice_create`. Orders are processed ``chunk_size``
+        at a time: the invoices of a chunk are built in memory first, created with recomputations
+        deferred to the end of the chunk, then their taxes are computed in one pass.
+        When not grouped, invoices are grouped by (invoice address, currency) within a chunk only.
+
+        :param post_messages: post the origin link message on the invoices
+        :param commit: commit after each chunk; a failing chunk is rolled back and logged
+                       without stopping the run
+        :returns: list of created invoices
+        """
+        if self._tracking_mode() == 'full':
+            # one tracking message per order and chunk, posted before the chunk is committed
+            self = self.with_context(installment_tracking='summary')
+        inv_obj = self.env['account.invoice'].with_context(mail_create_nolog=True, mail_notrack=True)
+        note_subtype_id = self.env.ref('mail.mt_note').id
+        invoice_ids = []
+        failed_ids = []
+        for ids in split_every(chunk_size, self.ids):
+            orders = self.browse(ids)
+            try:
+                references = {}
+                order_invoices = {}
+                with self.env.norecompute():
+                    for vals, origin_orders in orders._prepare_bulk_invoices(grouped=grouped, final=final):
+                        invoice = inv_obj.create(vals)
+                        references[invoice] = origin_orders
+                        for order in origin_orders:
+                            order_invoices.setdefault(order.id, set()).add(invoice.id)
+                inv_obj.recompute()
+                invoices = inv_obj.browse([invoice.id for invoice in references])
+                for line in invoices.mapped('invoice_line_ids'):
+                    line._set_additional_fields(line.invoice_id)
+                invoices.compute_taxes()
+                if post_messages:
+                    for invoice, origin_orders in references.items():
+                        invoice.message_post_with_view('mail.message_origin_link',
+                                                       values={'self': invoice, 'origin': origin_orders},
+                                                       subtype_id=note_subtype_id)
+                self._link_invoices(order_invoices)
+                if commit:
+                    self._flush_tracking()
+                    self.env.cr.commit()
+                invoice_ids.extend(invoices.ids)
+                self.invalidate_cache()
+            except Exception:
+                if not commit:
+                    raise
+                self.env.cr.rollback()
+                # drop the cache and the pending recomputations of the rolled-back chunk
+                self.env.clear()
+                self._discard_tracking()
+                _logger.exception("Bulk invoicing failed for installment orders %s", ids)
+                failed_ids.extend(ids)
+        self._flush_tracking()
+        if failed_ids:
+            _logger.warning("Bulk invoicing: %d orders failed, %d invoices created", len(failed_ids), len(invoice_ids))
+        elif not invoice_ids:
+            raise UserError(_('There is no invoicable line.'))
+        return invoice_ids
+
     @api.multi
     def action_draft(self):
         orders = self.filtered(lambda s: s.state in ['cancel', 'sent'])
@@ -500,6 +972,7 @@ class InstallmentSales(models.Model):
 
     @api.multi
     def action_cancel(self):
+        self.mapped('schedule_line_ids').filtered(lambda l: l.state == 'open').write({'state': 'cancel'})
         return self.write({'state': 'cancel'})
 
     @api.multi
@@ -510,17 +983,78 @@ class InstallmentSales(models.Model):
         return {'name': self.name}
 
     @api.multi
+    @instrumented
     def action_confirm(self):
-        for order in self:
-            order.state = 'sale'
-            order.confirmation_date = fields.Datetime.now()
-            if self.env.context.get('send_email'):
-                self.force_quotation_send()
-            order.order_line._action_procurement_create()
+        """
+        Confirm the orders together: their state and confirmation date are set in one write, the
+        procurements of all their lines are created at once and their schedules in batch. The
+        confirmation emails requested with the ``send_email`` context key are not sent here but
+        queued for :meth:`_cron_send_confirmation_emails`.
+        """
+        orders = self
+        if len(self) > 1 and self._tracking_mode() == 'full':
+            # one tracking message per order for the whole confirmation
+            orders = self.with_context(installment_tracking='summary')
+        vals = {'state': 'sale', 'confirmation_date': fields.Datetime.now()}
+        if self.env.context.get('send_email'):
+            vals['confirmation_email_pending'] = True
+        orders.write(vals)
+        orders.mapped('order_line')._action_procurement_create()
+        orders._generate_schedule()
         if self.env['ir.values'].get_default('sale.config.settings', 'auto_done_setting'):
-            self.action_done()
+            orders.action_done()
+        if orders is not self:
+            orders._flush_tracking()
         return True
 
+    @api.model
+    def _cron_send_confirmation_emails(self, chunk_size=100):
+        """
+        Send the queued confirmation emails, ``chunk_size`` orders per transaction. The emails are
+        rendered here and handed to the outgoing mail queue instead of being sent inline. An order
+        whose email fails is rolled back alone and left pending for the next run.
+        """
+        sent = 0
+        failed_ids = []
+        while True:
+            orders = self.search([('confirmation_email_pending', '=', True), ('id', 'not in', failed_ids)],
+                                 limit=chunk_size)
+            if not orders:
+                break
+            done = self.browse()
+            for order in orders:
+                try:
+                    with self.env.cr.savepoint():
+                        order._send_confirmation_email()
+                    done |= order
+                except Exception:
+                    _logger.exception("Could not send the confirmation email of installment order %s", order.id)
+                    self.env.clear()
+                    failed_ids.append(order.id)
+            done.with_context(installment_tracking='off').write({'confirmation_email_pending': False})
+            self.env.cr.commit()
+            sent += len(done)
+            self.invalidate_cache()
+        if sent or failed_ids:
+            _logger.info("Queued the confirmation emails of %d installment orders, %d failed", sent, len(failed_ids))
+        return sent
+
+    @api.multi
+    def _send_confirmation_email(self):
+        """
+        Post the confirmation email of the orders and queue it. Unlike ``force_quotation_send``,
+        which replaces the context with the one of the email action, ``mail_notify_force_send`` is
+        kept so that the notifications go through the mail queue.
+        """
+        # the email templates are defined on the delegated sale orders
+        for order in self.mapped('sale_order_id'):
+            email_ctx = dict(order.action_quotation_send().get('context') or {})
+            template_id = email_ctx.get('default_template_id')
+            if not template_id:
+                continue
+            email_ctx.update(default_email_from=order.company_id.email, mail_notify_force_send=False)
+            order.with_context(email_ctx).message_post_with_template(template_id)
+
     @api.multi
     def _create_analytic_account(self, prefix=None):
         for order in self:
@@ -555,20 +1089,44 @@ class InstallmentSales(models.Model):
     @api.multi
     def _get_tax_amount_by_group(self):
         self.ensure_one()
+        return self._get_tax_amount_by_group_batch()[self.id]
+
+    @api.multi
+    @instrumented
+    def _get_tax_amount_by_group_batch(self):
+        """
+        Batch version of :meth:`_get_tax_amount_by_group`: return ``{order_id: [(group name, amount)]}``.
+        Identical (taxes, price, quantity, product, partner) line combinations are computed once,
+        and the taxes counted in each group (the tax itself and its children) are resolved once
+        for all the orders.
+        """
+        lines = self.mapped('order_line')
+        taxes = lines.mapped('tax_id')
+        tax_group = {}
+        tax_members = {}
+        for tax in taxes:
+            tax_group[tax.id] = tax.tax_group_id.id
+            tax_members[tax.id] = frozenset([tax.id] + tax.children_tax_ids.ids)
+        groups = dict((group.id, (group.sequence, group.name)) for group in taxes.mapped('tax_group_id'))
+
+        computed = {}
         res = {}
-        currency = self.currency_id or self.company_id.currency_id
-        for line in self.order_line:
-            price_reduce = line.price_unit * (1.0 - line.discount / 100.0)
-            taxes = line.tax_id.compute_all(price_reduce, quantity=line.product_uom_qty, product=line.product_id,
-                                            partner=self.partner_shipping_id)['taxes']
-            for tax in line.tax_id:
-                group = tax.tax_group_id
-                res.setdefault(group, 0.0)
-                for t in taxes:
-                    if t['id'] == tax.id or t['id'] in tax.children_tax_ids.ids:
-                        res[group] += t['amount']
-        res = sorted(res.items(), key=lambda l: l[0].sequence)
-        res = map(lambda l: (l[0].name, l[1]), res)
+        for order in self:
+            amounts = {}
+            partner = order.partner_shipping_id
+            for line in order.order_line:
+                price_reduce = line.price_unit * (1.0 - line.discount / 100.0)
+                key = (tuple(line.tax_id.ids), price_reduce, line.product_uom_qty, line.product_id.id, partner.id)
+                if key not in computed:
+                    computed[key] = line.tax_id.compute_all(price_reduce, quantity=line.product_uom_qty,
+                                                            product=line.product_id, partner=partner)['taxes']
+                for tax_id in key[0]:
+                    group_id = tax_group[tax_id]
+                    amounts.setdefault(group_id, 0.0)
+                    members = tax_members[tax_id]
+                    for t in computed[key]:
+                        if t['id'] in members:
+                            amounts[group_id] += t['amount']
+            res[order.id] = [(groups[group_id][1], amount)
+                             for group_id, amount in sorted(amounts.items(), key=lambda l: groups[l[0]][0])]
         return res
-
-
@@ -0,0 +1,213 @@
+import logging
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import split_every
+
+from ..instrumentation import instrumented
+
+_logger = logging.getLogger(__name__)
+
+SCHEDULE_BATCH_SIZE = 1000
+
+SCHEDULE_COLUMNS = ['order_id', 'sequence', 'kind', 'due_date', 'principal', 'interest', 'amount', 'balance',
+                    'state']
+
+
+class InstallmentScheduleLine(models.Model):
+    _name = 'installment.schedule.line'
+    _description = 'Installment Payment Schedule Line'
+    _order = 'order_id, sequence, id'
+
+    order_id = fields.Many2one('installment.sale', 'Installment Sale', required=True, index=True,
+                               ondelete='cascade', readonly=True)
+    sequence = fields.Integer('Installment #', readonly=True)
+    kind = fields.Selection([
+        ('advance', 'Advance'),
+        ('deferred_advance', 'Deferred Advance'),
+        ('amortization', 'Monthly Amortization'),
+    ], string='Type', required=True, readonly=True)
+    due_date = fields.Date('Due Date', required=True, index=True, readonly=True)
+    currency_id = fields.Many2one('res.currency', related='order_id.currency_id', readonly=True)
+    principal = fields.Monetary('Principal', readonly=True)
+    interest = fields.Monetary('Interest', readonly=True)
+    amount = fields.Monetary('Amount Due', readonly=True)
+    balance = fields.Monetary('Balance', readonly=True, help="Remaining amount due once this installment is paid.")
+    state = fields.Selection([
+        ('open', 'Open'),
+        ('invoiced', 'Invoiced'),
+        ('paid', 'Paid'),
+        ('cancel', 'Cancelled'),
+    ], string='Status', default='open', required=True, index=True, readonly=True)
+    invoice_id = fields.Many2one('account.invoice', 'Invoice', readonly=True, copy=False, index=True)
+
+    @api.multi
+    def _prepare_invoice(self):
+        """ Return the values of the invoice billing this installment. """
+        self.ensure_one()
+        order = self.order_id
+        sale_line = order.order_line[:1]
+        product = sale_line.product_id
+        fpos = order.fiscal_position_id or order.partner_invoice_id.property_account_position_id
+        account = product.property_account_income_id or product.categ_id.property_account_income_categ_id
+        if not account:
+            raise UserError(_('Please define income account for this product: "%s" (id:%d) - or for its category: '
+                              '"%s".') % (product.name, product.id, product.categ_id.name))
+        if fpos:
+            account = fpos.map_account(account)
+        vals = order._prepare_invoice()
+        vals['name'] = '%s %d' % (dict(self._fields['kind'].selection)[self.kind], self.sequence)
+        vals['date_due'] = self.due_date
+        vals['invoice_line_ids'] = [(0, 0, {
+            'name': '%s - %s' % (order.name, vals['name']),
+            'origin': order.name,
+            'account_id': account.id,
+            'price_unit': self.amount,
+            'quantity': 1.0,
+            'uom_id': sale_line.product_uom.id,
+            'product_id': product.id,
+            'invoice_line_tax_ids': [(6, 0, sale_line.tax_id.ids)],
+            'account_analytic_id': order.project_id.id,
+        })]
+        return vals
+
+    @api.multi
+    @instrumented
+    def _create_invoices(self, validate=True):
+        """
+        Bill the installments of ``self``, one invoice per installment, link the invoices to their
+        orders and mark the installments as invoiced.
+
+        :returns: the created invoices
+        """
+        inv_obj = self.env['account.invoice'].with_context(mail_create_nolog=True, mail_notrack=True)
+        line_invoices = []
+        with self.env.norecompute():
+            for line in self:
+                line_invoices.append((line, inv_obj.create(line._prepare_invoice())))
+        inv_obj.recompute()
+        invoices = inv_obj.browse([invoice.id for line, invoice in line_invoices])
+        invoices.compute_taxes()
+        if validate:
+            invoices.action_invoice_open()
+        if line_invoices:
+            self.env.cr.execute("""
+                UPDATE installment_schedule_line line
+                SET invoice_id = billed.invoice_id, state = 'invoiced',
+                    write_uid = %%s, write_date = (now() at time zone 'UTC')
+                FROM (VALUES %s) AS billed (id, invoice_id)
+                WHERE line.id = billed.id
+            """ % ', '.join(['(%s, %s)'] * len(line_invoices)),
+                [self.env.uid] + [value for line, invoice in line_invoices for value in (line.id, invoice.id)])
+            self.invalidate_cache(['invoice_id', 'state'], self.ids)
+        order_invoices = {}
+        for line, invoice in line_invoices:
+            order_invoices.setdefault(line.order_id.id, set()).add(invoice.id)
+        self.env['installment.sale']._link_invoices(order_invoices)
+        return invoices
+
+
+class InstallmentSales(models.Model):
+    _inherit = 'installment.sale'
+
+    schedule_line_ids = fields.One2many('installment.schedule.line', 'order_id', 'Payment Schedule', readonly=True,
+                                        copy=False)
+
+    @api.multi
+    def _prepare_schedule_rows(self):
+        """
+        Return the payment schedule of the order as a list of dicts keyed by ``SCHEDULE_COLUMNS``.
+        Advances come first, monthly amortizations follow one month after the last advance.
+        """
+        self.ensure_one()
+        term = self.env['deferred.revenue.custom']._get_term_table()['terms'].get(self.deferred_revenue_id.id)
+        if not term or not term['number_of_months']:
+            return []
+        currency = self.currency_id or self.company_id.currency_id
+        start = fields.Date.from_string(self.confirmation_date or fields.Date.context_today(self))
+
+        advances = []
+        if self.is_spot_advance and self.spot_advance:
+            advances = [('advance', self.spot_advance)]
+        elif self.is_deferred_advance and self.deferred_advance:
+            advances = [('deferred_advance', self.deferred_advance)] * (term['deferred_adv_count'] or 1)
+        elif self.advance_payment:
+            advances = [('advance', self.advance_payment)]
+
+        months = term['number_of_months']
+        principal_total = currency.round(sum(line.price_unit for line in self.order_line) - self.advance_payment)
+        principal = currency.round(principal_total / months)
+        amortization = currency.round(self.monthly_amortization)
+
+        entries = [(kind, currency.round(amount), 0.0) for kind, amount in advances]
+        for month in range(months):
+            if month == months - 1:
+                # the last installment absorbs the rounding differences of the principal
+                principal = principal_total - principal * (months - 1)
+            entries.append(('amortization', principal, amortization - principal))
+
+        balance = sum(entry[1] + entry[2] for entry in entries)
+        offset = max(len(advances), 1)
+        rows = []
+        for index, (kind, principal, interest) in enumerate(entries):
+            due = start + relativedelta(months=index if kind != 'amortization' else offset + index - len(advances))
+            balance -= principal + interest
+            rows.append({
+                'order_id': self.id,
+                'sequence': index + 1,
+                'kind': kind,
+                'due_date': fields.Date.to_string(due),
+                'principal': principal,
+                'interest': currency.round(interest),
+                'amount': currency.round(principal + interest),
+                'balance': currency.round(balance),
+                'state': 'open',
+            })
+        return rows
+
+    @api.multi
+    @instrumented
+    def _generate_schedule(self, batch_size=SCHEDULE_BATCH_SIZE):
+        """
+        (Re)generate the payment schedule of the orders, ``batch_size`` orders at a time. The lines
+        of each batch are inserted with a single multi-row INSERT, and the ORM cache is released
+        between batches so that thousands of orders can be processed at once.
+        Orders that already have invoiced or paid installments are left untouched.
+        """
+        cr = self.env.cr
+        for ids in split_every(batch_size, self.ids):
+            cr.execute("""SELECT DISTINCT order_id FROM installment_schedule_line
+                          WHERE order_id IN %s AND state IN ('invoiced', 'paid')""", (ids,))
+            locked_ids = set(row[0] for row in cr.fetchall())
+            if locked_ids:
+                _logger.info("Payment schedule kept for orders %s: installments already invoiced", sorted(locked_ids))
+            ids = tuple(set(ids) - locked_ids)
+            if not ids:
+                continue
+            cr.execute("DELETE FROM installment_schedule_line WHERE order_id IN %s", (ids,))
+            rows = []
+            for order in self.browse(ids):
+                rows.extend(order._prepare_schedule_rows())
+            if rows:
+                self._insert_schedule_rows(rows)
+            self.invalidate_cache()
+
+    @api.model
+    def _insert_schedule_rows(self, rows):
+        placeholders = ', '.join(
+            ["(%s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'), " +
+             ', '.join(['%s'] * len(SCHEDULE_COLUMNS)) + ")"] * len(rows))
+        params = []
+        for row in rows:
+            params.extend([self.env.uid, self.env.uid])
+            params.extend(row[column] for column in SCHEDULE_COLUMNS)
+        self.env.cr.execute(
+            "INSERT INTO installment_schedule_line (create_uid, create_date, write_uid, write_date, %s) VALUES %s" % (
+                ', '.join(SCHEDULE_COLUMNS), placeholders), params)
+
+    @api.multi
+    def action_regenerate_schedule(self):
+        self._generate_schedule()
+        return True
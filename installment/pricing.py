@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+ORM-free installment pricing engine.
+
+Every argument of :func:`compute_installments` is a sequence with one item per contract, so a
+whole portfolio is priced in a single pass. NumPy is used when it is available, otherwise the
+engine falls back on an equivalent pure Python loop.
+
+Interest rules (``interest_type``):
+
+- ``simple``: ``interest_rate`` is a flat rate applied once to the balance, whatever the term.
+- ``compound``: ``interest_rate`` is a yearly rate compounded monthly over ``number_of_months``.
+"""
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    _logger.debug("numpy is not available, the installment pricing engine uses its pure Python fallback.")
+
+RESULT_KEYS = ['advance', 'spot_advance', 'deferred_advance', 'balance', 'interest', 'monthly_amortization']
+
+
+def compute_installments(unit_price, advance_payment_type, advance_payment, interest_type, interest_rate,
+                         number_of_months, spot_adv_discount, deferred_adv_discount, deferred_adv_count):
+    """
+    Price a batch of installment contracts.
+
+    :param unit_price: selling prices
+    :param advance_payment_type: ``'perc'``, ``'fix'`` or anything else for no advance
+    :param advance_payment: advance percentage or fixed amount, depending on the type
+    :param interest_type: ``'simple'`` or ``'compound'``
+    :param interest_rate: interest rates, in percent
+    :param number_of_months: terms; contracts without term have no amortization
+    :param spot_adv_discount: paid-up advance discounts, in percent
+    :param deferred_adv_discount: deferred advance discounts, in percent
+    :param deferred_adv_count: number of deferred advances (0 is handled as 1)
+    :returns: a dict mapping each of ``RESULT_KEYS`` to the list of values of the contracts
+    """
+    args = (unit_price, advance_payment_type, advance_payment, interest_type, interest_rate, number_of_months,
+            spot_adv_discount, deferred_adv_discount, deferred_adv_count)
+    if not len(unit_price):
+        return dict((key, []) for key in RESULT_KEYS)
+    if numpy is not None:
+        return _compute_numpy(*args)
+    return _compute_python(*args)
+
+
+def _compute_numpy(unit_price, advance_payment_type, advance_payment, interest_type, interest_rate,
+                   number_of_months, spot_adv_discount, deferred_adv_discount, deferred_adv_count):
+    price = numpy.asarray(unit_price, dtype=float)
+    advance_value = numpy.asarray(advance_payment, dtype=float)
+    advance_type = numpy.asarray(advance_payment_type, dtype=object)
+    compound = numpy.asarray(interest_type, dtype=object) == 'compound'
+    rate = numpy.asarray(interest_rate, dtype=float) / 100.0
+    months = numpy.asarray(number_of_months, dtype=float)
+    spot_discount = numpy.asarray(spot_adv_discount, dtype=float) / 100.0
+    deferred_discount = numpy.asarray(deferred_adv_discount, dtype=float) / 100.0
+    deferred_count = numpy.asarray(deferred_adv_count, dtype=float)
+
+    advance = numpy.where(advance_type == 'perc', price * advance_value / 100.0,
+                          numpy.where(advance_type == 'fix', advance_value, 0.0))
+    balance = price - advance
+    has_term = months > 0
+    balance_with_interest = numpy.where(
+        compound, balance * numpy.power(1.0 + rate / 12.0, numpy.where(has_term, months, 0.0)),
+        balance * (1.0 + rate))
+    monthly = numpy.where(has_term, balance_with_interest / numpy.where(has_term, months, 1.0), 0.0)
+    deferred_advance = advance * (1.0 - deferred_discount) / numpy.where(deferred_count > 0, deferred_count, 1.0)
+    return {
+        'advance': advance.tolist(),
+        'spot_advance': (advance * (1.0 - spot_discount)).tolist(),
+        'deferred_advance': deferred_advance.tolist(),
+        'balance': balance.tolist(),
+        'interest': (balance_with_interest - balance).tolist(),
+        'monthly_amortization': monthly.tolist(),
+    }
+
+
+def _compute_python(unit_price, advance_payment_type, advance_payment, interest_type, interest_rate,
+                    number_of_months, spot_adv_discount, deferred_adv_discount, deferred_adv_count):
+    res = dict((key, []) for key in RESULT_KEYS)
+    for price, advance_type, advance_value, int_type, rate, months, spot_discount, deferred_discount, count in zip(
+            unit_price, advance_payment_type, advance_payment, interest_type, interest_rate, number_of_months,
+            spot_adv_discount, deferred_adv_discount, deferred_adv_count):
+        price = float(price)
+        if advance_type == 'perc':
+            advance = price * advance_value / 100.0
+        elif advance_type == 'fix':
+            advance = float(advance_value)
+        else:
+            advance = 0.0
+        balance = price - advance
+        if int_type == 'compound':
+            balance_with_interest = balance * (1.0 + rate / 1200.0) ** (months if months > 0 else 0)
+        else:
+            balance_with_interest = balance * (1.0 + rate / 100.0)
+        res['advance'].append(advance)
+        res['spot_advance'].append(advance * (1.0 - spot_discount / 100.0))
+        res['deferred_advance'].append(advance * (1.0 - deferred_discount / 100.0) / (count if count > 0 else 1))
+        res['balance'].append(balance)
+        res['interest'].append(balance_with_interest - balance)
+        res['monthly_amortization'].append(balance_with_interest / months if months > 0 else 0.0)
+    return res
+
+
+def contract_total(advance_choice, spot_advance, deferred_advance, deferred_adv_count, monthly_amortization,
+                   number_of_months):
+    """
+    Return the total paid over a contract, depending on how its advance is paid.
+
+    :param advance_choice: ``'spot'`` for a paid-up advance, ``'deferred'`` for deferred advances,
+                           anything else when no choice was made yet (the total is then 0)
+    """
+    if advance_choice == 'spot':
+        return spot_advance + monthly_amortization * number_of_months
+    elif advance_choice == 'deferred':
+        return deferred_advance * deferred_adv_count + monthly_amortization * number_of_months
+    return 0.0
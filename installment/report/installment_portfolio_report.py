@@ -0,0 +1,132 @@
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+LAST_REFRESH_PARAM = 'installment.portfolio_report.last_refresh'
+
+
+class InstallmentPortfolioReport(models.Model):
+    """
+    Receivables portfolio of the installment contracts, one row per contract and due month.
+    The rows live in a real table that :meth:`_refresh` maintains incrementally: only the
+    contracts changed since the previous refresh (order or payment schedule) are rebuilt.
+    """
+    _name = 'installment.portfolio.report'
+    _description = 'Installment Portfolio Analysis'
+    _auto = False
+    _rec_name = 'month'
+    _order = 'month desc'
+
+    order_id = fields.Many2one('installment.sale', 'Installment Sale', readonly=True)
+    partner_id = fields.Many2one('res.partner', 'Customer', readonly=True)
+    user_id = fields.Many2one('res.users', 'Salesperson', readonly=True)
+    company_id = fields.Many2one('res.company', 'Company', readonly=True)
+    deferred_revenue_id = fields.Many2one('deferred.revenue.custom', 'Purchase Term', readonly=True)
+    product_category_id = fields.Many2one('product.category', 'Category', readonly=True)
+    month = fields.Date('Due Month', readonly=True)
+    line_count = fields.Integer('# of Installments', readonly=True)
+    amount_due = fields.Float('Amount Due', readonly=True)
+    principal = fields.Float('Principal', readonly=True)
+    interest = fields.Float('Interest', readonly=True)
+    advance_due = fields.Float('Advance Due', readonly=True)
+    amortization_due = fields.Float('Monthly Amortization Due', readonly=True)
+    paid_amount = fields.Float('Collected', readonly=True)
+    outstanding = fields.Float('Outstanding Balance', readonly=True)
+
+    @api.model_cr
+    def init(self):
+        cr = self._cr
+        cr.execute("""
+            CREATE TABLE IF NOT EXISTS installment_portfolio_report (
+                id serial PRIMARY KEY,
+                order_id integer NOT NULL REFERENCES installment_sale (id) ON DELETE CASCADE,
+                partner_id integer,
+                user_id integer,
+                company_id integer,
+                deferred_revenue_id integer,
+                product_category_id integer,
+                month date,
+                line_count integer,
+                amount_due numeric,
+                principal numeric,
+                interest numeric,
+                advance_due numeric,
+                amortization_due numeric,
+                paid_amount numeric,
+                outstanding numeric
+            )
+        """)
+        cr.execute("CREATE INDEX IF NOT EXISTS installment_portfolio_report_order_id_index "
+                   "ON installment_portfolio_report (order_id)")
+        cr.execute("CREATE INDEX IF NOT EXISTS installment_portfolio_report_month_index "
+                   "ON installment_portfolio_report (month)")
+        # change detection of the incremental refresh
+        cr.execute("CREATE INDEX IF NOT EXISTS installment_sale_write_date_index ON installment_sale (write_date)")
+        cr.execute("CREATE INDEX IF NOT EXISTS installment_schedule_line_write_date_index "
+                   "ON installment_schedule_line (write_date)")
+
+    def _insert_query(self, where):
+        return """
+            INSERT INTO installment_portfolio_report (order_id, partner_id, user_id, company_id,
+                deferred_revenue_id, product_category_id, month, line_count, amount_due, principal, interest,
+                advance_due, amortization_due, paid_amount, outstanding)
+            SELECT sale.id, sale.order_partner_id, sale.user_id, sale.company_id,
+                   sale.deferred_revenue_id, sale.product_category_id,
+                   date_trunc('month', line.due_date)::date,
+                   count(*),
+                   sum(line.amount),
+                   sum(line.principal),
+                   sum(line.interest),
+                   sum(CASE WHEN line.kind != 'amortization' THEN line.amount ELSE 0 END),
+                   sum(CASE WHEN line.kind = 'amortization' THEN line.amount ELSE 0 END),
+                   sum(CASE WHEN line.state = 'paid' THEN line.amount ELSE 0 END),
+                   sum(CASE WHEN line.state IN ('open', 'invoiced') THEN line.amount ELSE 0 END)
+            FROM installment_schedule_line line
+            JOIN installment_sale sale ON sale.id = line.order_id
+            WHERE line.state != 'cancel' AND %s
+            GROUP BY sale.id, date_trunc('month', line.due_date)
+        """ % where
+
+    @api.model
+    def _refresh(self, full=False):
+        """
+        Bring the report up to date. Without ``full``, only the contracts whose order or schedule
+        changed since the last refresh are rebuilt.
+
+        Write dates are set when transactions start, so the changes of the transactions still
+        open during a refresh carry write dates older than it. The watermark is therefore the
+        start of the oldest open transaction of the database, capped at now: the next refresh
+        scans again from there and catches these changes once they are committed.
+        """
+        cr = self.env.cr
+        params = self.env['ir.config_parameter'].sudo()
+        cr.execute("""
+            SELECT (least(min(xact_start), now()) at time zone 'UTC')::timestamp
+            FROM pg_stat_activity WHERE datname = current_database()
+        """)
+        watermark = cr.fetchone()[0]
+        last_refresh = params.get_param(LAST_REFRESH_PARAM)
+        if full or not last_refresh:
+            cr.execute("TRUNCATE installment_portfolio_report")
+            cr.execute(self._insert_query('TRUE'))
+            _logger.info("Installment portfolio report rebuilt: %d rows", cr.rowcount)
+        else:
+            cr.execute("""
+                SELECT id FROM installment_sale WHERE write_date >= %s
+                UNION
+                SELECT order_id FROM installment_schedule_line WHERE write_date >= %s
+            """, (last_refresh, last_refresh))
+            order_ids = tuple(row[0] for row in cr.fetchall())
+            if order_ids:
+                cr.execute("DELETE FROM installment_portfolio_report WHERE order_id IN %s", (order_ids,))
+                cr.execute(self._insert_query('sale.id IN %s'), (order_ids,))
+            _logger.info("Installment portfolio report refreshed for %d contracts", len(order_ids))
+        params.set_param(LAST_REFRESH_PARAM, fields.Datetime.to_string(watermark))
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def _cron_refresh(self):
+        return self._refresh()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from .. import pricing
+
+
+def _contracts(**overrides):
+    """ Return the arguments of a batch pricing one contract, with ``overrides`` applied. """
+    args = {
+        'unit_price': [100000.0],
+        'advance_payment_type': ['perc'],
+        'advance_payment': [20.0],
+        'interest_type': ['simple'],
+        'interest_rate': [12.0],
+        'number_of_months': [24],
+        'spot_adv_discount': [10.0],
+        'deferred_adv_discount': [5.0],
+        'deferred_adv_count': [4],
+    }
+    args.update(overrides)
+    return args
+
+
+class TestPricing(unittest.TestCase):
+
+    def assertResultsEqual(self, first, second):
+        self.assertEqual(sorted(first), sorted(second))
+        for key in pricing.RESULT_KEYS:
+            self.assertEqual(len(first[key]), len(second[key]))
+            for value, other in zip(first[key], second[key]):
+                self.assertAlmostEqual(value, other, places=6, msg=key)
+
+    def test_simple_interest(self):
+        res = pricing._compute_python(**_contracts())
+        self.assertAlmostEqual(res['advance'][0], 20000.0)
+        self.assertAlmostEqual(res['spot_advance'][0], 18000.0)
+        self.assertAlmostEqual(res['deferred_advance'][0], 4750.0)
+        self.assertAlmostEqual(res['balance'][0], 80000.0)
+        # flat rate, applied once whatever the term
+        self.assertAlmostEqual(res['interest'][0], 9600.0)
+        self.assertAlmostEqual(res['monthly_amortization'][0], 89600.0 / 24)
+
+    def test_compound_interest(self):
+        res = pricing._compute_python(**_contracts(interest_type=['compound']))
+        # yearly rate compounded monthly
+        total = 80000.0 * (1 + 0.01) ** 24
+        self.assertAlmostEqual(res['interest'][0], total - 80000.0)
+        self.assertAlmostEqual(res['monthly_amortization'][0], total / 24)
+
+    def test_advance_types(self):
+        res = pricing._compute_python(**_contracts(
+            unit_price=[100000.0, 100000.0], advance_payment_type=['fix', 'none'], advance_payment=[15000.0, 20.0],
+            interest_type=['simple'] * 2, interest_rate=[0.0] * 2, number_of_months=[10] * 2,
+            spot_adv_discount=[0.0] * 2, deferred_adv_discount=[0.0] * 2, deferred_adv_count=[0] * 2))
+        self.assertEqual(res['advance'], [15000.0, 0.0])
+        self.assertEqual(res['balance'], [85000.0, 100000.0])
+        # no deferred advance count means a single deferred advance
+        self.assertEqual(res['deferred_advance'], [15000.0, 0.0])
+        self.assertEqual(res['monthly_amortization'], [8500.0, 10000.0])
+
+    def test_no_term(self):
+        for interest_type in ('simple', 'compound'):
+            res = pricing._compute_python(**_contracts(interest_type=[interest_type], number_of_months=[0]))
+            self.assertEqual(res['monthly_amortization'], [0.0])
+            self.assertAlmostEqual(res['balance'][0], 80000.0)
+
+    def test_empty_batch(self):
+        res = pricing.compute_installments(**_contracts(**dict((key, []) for key in _contracts())))
+        self.assertEqual(res, dict((key, []) for key in pricing.RESULT_KEYS))
+
+    @unittest.skipIf(pricing.numpy is None, "numpy is not installed")
+    def test_numpy_parity(self):
+        args = {
+            'unit_price': [100000.0, 55000.0, 12000.0, 80000.0, 0.0, 33333.33],
+            'advance_payment_type': ['perc', 'fix', 'none', 'perc', 'fix', 'perc'],
+            'advance_payment': [20.0, 5000.0, 10.0, 0.0, 0.0, 33.0],
+            'interest_type': ['simple', 'compound', 'simple', 'compound', 'compound', 'simple'],
+            'interest_rate': [12.0, 18.0, 0.0, 6.0, 10.0, 7.5],
+            'number_of_months': [24, 36, 0, 0, 12, 60],
+            'spot_adv_discount': [10.0, 0.0, 5.0, 0.0, 0.0, 2.5],
+            'deferred_adv_discount': [5.0, 0.0, 0.0, 5.0, 0.0, 1.0],
+            'deferred_adv_count': [4, 0, 1, 3, 0, 6],
+        }
+        self.assertResultsEqual(pricing._compute_numpy(**args), pricing._compute_python(**args))
+
+    def test_contract_total(self):
+        self.assertEqual(pricing.contract_total('spot', 18000.0, 4750.0, 4, 1000.0, 24), 18000.0 + 24000.0)
+        self.assertEqual(pricing.contract_total('deferred', 18000.0, 4750.0, 4, 1000.0, 24), 19000.0 + 24000.0)
+        self.assertEqual(pricing.contract_total(False, 18000.0, 4750.0, 4, 1000.0, 24), 0.0)
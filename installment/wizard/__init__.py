@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+from . import installment_quotation_print
+from . import installment_payment_allocation
@@ -0,0 +1,243 @@
+import logging
+import re
+import time
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import float_compare, float_is_zero
+
+_logger = logging.getLogger(__name__)
+
+# within a due date, advances are settled before deferred advances and monthly amortizations
+KIND_PRIORITY = {'advance': 0, 'deferred_advance': 1, 'amortization': 2}
+REFERENCE_SEPARATORS = re.compile(r'[\s,;]+')
+
+
+class InstallmentPaymentAllocation(models.TransientModel):
+    """
+    Allocation of the customer payments of bank statements to the installments they settle.
+    Payments mentioning an order reference pay that order, the others pay the orders of their
+    customer; installments are paid oldest due first, and each payment is reconciled with all
+    the invoices it settles at once. Installments not billed yet are billed when they are paid.
+    """
+    _name = 'installment.payment.allocation'
+    _description = 'Allocate Installment Payments'
+
+    statement_ids = fields.Many2many('account.bank.statement', string='Bank Statements', required=True)
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+    payment_count = fields.Integer('Payments', readonly=True)
+    allocated_count = fields.Integer('Payments Allocated', readonly=True)
+    unmatched_count = fields.Integer('Payments Left to Reconcile', readonly=True)
+    installment_count = fields.Integer('Installments Settled', readonly=True)
+    amount_allocated = fields.Float('Amount Allocated', readonly=True)
+    duration = fields.Float('Duration (s)', readonly=True)
+
+    @api.multi
+    def action_allocate(self):
+        self.ensure_one()
+        statement_lines = self.statement_ids.mapped('line_ids').filtered(
+            lambda line: not line.journal_entry_ids and line.amount > 0)
+        if not statement_lines:
+            raise UserError(_('There is no customer payment left to reconcile on these statements.'))
+        stats = self._allocate_payments(statement_lines)
+        stats['state'] = 'done'
+        self.write(stats)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    @api.model
+    def _allocate_payments(self, statement_lines):
+        """
+        Allocate and reconcile the payments ``statement_lines``.
+
+        :returns: dict of statistics (see the fields of the wizard)
+        """
+        start = time.time()
+        statement_lines = statement_lines.sorted(key=lambda line: (line.date, line.id))
+        index = self._build_obligation_index(statement_lines)
+        receivables = self._get_receivable_lines(
+            [obligation['invoice_id'] for obligation in index['by_line'].values() if obligation['invoice_id']])
+
+        stats = {'payment_count': len(statement_lines), 'allocated_count': 0, 'installment_count': 0,
+                 'amount_allocated': 0.0}
+        for statement_line in statement_lines:
+            obligations = self._match_obligations(statement_line, index)
+            if not obligations:
+                continue
+            # installments billed or paid by a failing payment are available again after its rollback
+            snapshot = [(obligation, obligation['invoice_id'], obligation['residual']) for obligation in obligations]
+            try:
+                with self.env.cr.savepoint():
+                    allocations = self._plan_payment(statement_line, obligations, receivables)
+                    amount = self._reconcile_payment(statement_line, allocations, receivables, index) if allocations else 0.0
+            except Exception:
+                _logger.exception("Could not reconcile the bank statement line %s", statement_line.id)
+                self.env.clear()
+                for obligation, invoice_id, residual in snapshot:
+                    obligation['invoice_id'] = invoice_id
+                    obligation['residual'] = residual
+                continue
+            if not allocations:
+                continue
+            stats['allocated_count'] += 1
+            stats['installment_count'] += len(allocations)
+            stats['amount_allocated'] += amount
+        stats['unmatched_count'] = stats['payment_count'] - stats['allocated_count']
+        stats['duration'] = time.time() - start
+        _logger.info("Installment payment allocation: %d/%d payments allocated to %d installments in %.2fs",
+                     stats['allocated_count'], stats['payment_count'], stats['installment_count'], stats['duration'])
+        return stats
+
+    @api.model
+    def _build_obligation_index(self, statement_lines):
+        """
+        Load the unpaid installments of the customers and orders referenced by the payments in a
+        single query, and index them in memory.
+
+        :returns: dict with ``obligations`` (``{order_id: [obligation]}``, oldest due first),
+                  ``by_line`` (``{schedule line id: obligation}``), ``by_partner``
+                  (``{commercial partner id: [order_id]}``), ``by_reference`` (``{order reference:
+                  order_id}``) and ``partners`` (``{order_id: commercial partner id}``)
+        """
+        partner_ids = tuple(set(statement_lines.mapped('partner_id.commercial_partner_id').ids)) or (0,)
+        references = tuple(set(token for line in statement_lines for token in self._get_references(line))) or ('',)
+        self.env.cr.execute("""
+            SELECT line.id, line.order_id, partner.commercial_partner_id, sale.name, sale.client_order_ref,
+                   line.kind, line.due_date, line.sequence, line.invoice_id,
+                   CASE WHEN line.invoice_id IS NULL THEN line.amount ELSE inv.residual END
+            FROM installment_schedule_line line
+            JOIN installment_sale sale ON sale.id = line.order_id
+            JOIN res_partner partner ON partner.id = sale.order_partner_id
+            LEFT JOIN account_invoice inv ON inv.id = line.invoice_id
+            WHERE sale.state IN ('sale', 'done')
+              AND (line.state = 'open' OR (line.state = 'invoiced' AND inv.state = 'open'))
+              AND (partner.commercial_partner_id IN %s OR sale.name IN %s OR sale.client_order_ref IN %s)
+        """, (partner_ids, references, references))
+        index = {'obligations': {}, 'by_line': {}, 'by_partner': {}, 'by_reference': {}, 'partners': {}}
+        for (line_id, order_id, partner_id, name, client_ref, kind, due_date, sequence, invoice_id,
+             residual) in self.env.cr.fetchall():
+            if order_id not in index['obligations']:
+                index['obligations'][order_id] = []
+                index['by_partner'].setdefault(partner_id, []).append(order_id)
+                index['partners'][order_id] = partner_id
+                index['by_reference'][name] = order_id
+                if client_ref:
+                    index['by_reference'].setdefault(client_ref, order_id)
+            obligation = {
+                'id': line_id,
+                'order_id': order_id,
+                'key': (due_date, KIND_PRIORITY[kind], sequence, line_id),
+                'invoice_id': invoice_id,
+                'residual': residual or 0.0,
+            }
+            index['obligations'][order_id].append(obligation)
+            index['by_line'][line_id] = obligation
+        for obligations in index['obligations'].values():
+            obligations.sort(key=lambda obligation: obligation['key'])
+        return index
+
+    @api.model
+    def _get_references(self, statement_line):
+        return [token for token in REFERENCE_SEPARATORS.split('%s %s' % (statement_line.name or '',
+                                                                         statement_line.ref or '')) if token]
+
+    @api.model
+    def _match_obligations(self, statement_line, index):
+        """ Return the unpaid installments of the orders paid by ``statement_line``, oldest due first. """
+        order_ids = [index['by_reference'][token] for token in self._get_references(statement_line)
+                     if token in index['by_reference']]
+        if not order_ids and statement_line.partner_id:
+            order_ids = index['by_partner'].get(statement_line.partner_id.commercial_partner_id.id, [])
+        return sorted((obligation for order_id in set(order_ids) for obligation in index['obligations'][order_id]),
+                      key=lambda obligation: obligation['key'])
+
+    @api.model
+    def _plan_payment(self, statement_line, obligations, receivables):
+        """
+        Spread the payment ``statement_line`` over ``obligations``, oldest due first. The installments
+        it reaches that are not billed yet are billed, and the payment is spread again on the residual
+        of their invoices, which includes their taxes, until it only reaches billed installments.
+
+        :returns: ``[(obligation, amount)]``
+        """
+        rounding = statement_line.journal_id.company_id.currency_id.rounding
+        while True:
+            remaining = statement_line.amount
+            allocations = []
+            to_bill = []
+            for obligation in obligations:
+                if float_is_zero(remaining, precision_rounding=rounding):
+                    break
+                if float_compare(obligation['residual'], 0.0, precision_rounding=rounding) <= 0:
+                    continue
+                amount = min(remaining, obligation['residual'])
+                remaining -= amount
+                allocations.append((obligation, amount))
+                if not obligation['invoice_id']:
+                    to_bill.append(obligation)
+            if not to_bill:
+                break
+            lines = self.env['installment.schedule.line'].browse([obligation['id'] for obligation in to_bill])
+            lines._create_invoices()
+            for obligation, line in zip(to_bill, lines):
+                obligation['invoice_id'] = line.invoice_id.id
+                obligation['residual'] = line.invoice_id.residual
+            receivables.update(self._get_receivable_lines(lines.mapped('invoice_id').ids))
+        for obligation, amount in allocations:
+            obligation['residual'] -= amount
+        return allocations
+
+    @api.model
+    def _get_receivable_lines(self, invoice_ids):
+        """ Return the open receivable journal items of the invoices as ``{invoice_id: move lines}``. """
+        receivables = {}
+        lines = self.env['account.move.line'].search([
+            ('invoice_id', 'in', list(set(invoice_ids))),
+            ('account_id.internal_type', '=', 'receivable'),
+            ('reconciled', '=', False),
+        ])
+        for line in lines:
+            receivables.setdefault(line.invoice_id.id, []).append(line)
+        return receivables
+
+    @api.model
+    def _reconcile_payment(self, statement_line, allocations, receivables, index):
+        """
+        Reconcile a payment with the invoices of its installments in one operation; the amount
+        exceeding the installments is kept as a customer credit.
+
+        :returns: the amount allocated to installments
+        """
+        rounding = statement_line.journal_id.company_id.currency_id.rounding
+        counterparts = []
+        allocated = 0.0
+        for obligation, amount in allocations:
+            for move_line in receivables.get(obligation['invoice_id'], []):
+                if float_is_zero(amount, precision_rounding=rounding):
+                    break
+                credit = min(amount, move_line.amount_residual)
+                if float_compare(credit, 0.0, precision_rounding=rounding) <= 0:
+                    continue
+                counterparts.append({'move_line': move_line, 'debit': 0.0, 'credit': credit, 'name': move_line.name})
+                amount -= credit
+                allocated += credit
+        if not counterparts:
+            return 0.0
+        if not statement_line.partner_id:
+            statement_line.write({'partner_id': index['partners'][allocations[0][0]['order_id']]})
+        new_lines = []
+        leftover = statement_line.amount - allocated
+        if float_compare(leftover, 0.0, precision_rounding=rounding) > 0:
+            new_lines.append({
+                'account_id': statement_line.partner_id.property_account_receivable_id.id,
+                'debit': 0.0,
+                'credit': leftover,
+                'name': _('Unallocated installment payment'),
+            })
+        statement_line.process_reconciliation(counterpart_aml_dicts=counterparts, new_aml_dicts=new_lines)
+        return allocated
@@ -0,0 +1,34 @@
+from odoo import api, fields, models
+
+from ..models.quotation import QUOTATION_WORKERS
+
+
+class InstallmentQuotationPrint(models.TransientModel):
+    """
+    Batch printing of installment quotations, either as a single ZIP archive of PDFs or as PDFs
+    attached to the orders. The printing is queued as an ``installment.quotation.print.job``;
+    PDFs are rendered in parallel and cached per order version (see
+    ``installment.sale._render_quotations``).
+    """
+    _name = 'installment.quotation.print'
+    _description = 'Print Installment Quotations'
+
+    order_ids = fields.Many2many('installment.sale', string='Orders', required=True)
+    output = fields.Selection([('zip', 'ZIP Archive'), ('attachment', 'Attachments on the Orders')],
+                              default='zip', required=True)
+    workers = fields.Integer('Parallel Renderings', default=QUOTATION_WORKERS, required=True)
+
+    @api.multi
+    def action_print(self):
+        self.ensure_one()
+        job = self.env['installment.quotation.print.job'].create({
+            'order_ids': [(6, 0, self.order_ids.ids)],
+            'output': self.output,
+            'workers': self.workers,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': job._name,
+            'res_id': job.id,
+            'view_mode': 'form',
+        }